@@ -0,0 +1,79 @@
+"""
+Benchmark del parseo de respuestas del modelo a itinerario.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_itinerary_parse [--repeat 200]
+
+Compara el parseo anterior de /generate (quitar ``` + json.loads + recorte
+find('{')/rfind('}')) con `extract_json_object` sobre las respuestas de
+benchmarks/itinerary_outputs/. Cada archivo es una salida real o típica del
+modelo; los que empiezan por 10_ son texto de chat y no deben dar JSON.
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+from services.itinerary_parser import extract_json_object, validate_itinerary
+
+CORPUS_DIR = Path(__file__).parent / "itinerary_outputs"
+
+
+def legacy_parse(text: str):
+    cleaned = text.replace("```json", "").replace("```", "").strip()
+    try:
+        obj = json.loads(cleaned)
+    except Exception:
+        obj = None
+        start = cleaned.find("{")
+        end = cleaned.rfind("}")
+        if start != -1 and end != -1 and end > start:
+            try:
+                obj = json.loads(cleaned[start : end + 1])
+            except Exception:
+                pass
+    return obj if isinstance(obj, dict) else None
+
+
+def _time_us(fn, text: str, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - started) * 1e6 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de parseo de itinerarios")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'archivo':32} {'antes':>6} {'ahora':>6} {'itin.':>6} {'µs antes':>9} {'µs ahora':>9}")
+    totals = {"legacy": 0, "new": 0, "valid": 0}
+    files = sorted(CORPUS_DIR.glob("*.txt"))
+    for path in files:
+        text = path.read_text(encoding="utf-8")
+        legacy = legacy_parse(text)
+        new = extract_json_object(text)
+        itinerary = validate_itinerary(new) if new and "dias" in new else None
+
+        totals["legacy"] += legacy is not None
+        totals["new"] += new is not None
+        totals["valid"] += itinerary is not None
+
+        print(
+            f"{path.name:32} {'ok' if legacy else '-':>6} {'ok' if new else '-':>6} "
+            f"{'ok' if itinerary else '-':>6} "
+            f"{_time_us(legacy_parse, text, args.repeat):9.1f} "
+            f"{_time_us(extract_json_object, text, args.repeat):9.1f}"
+        )
+
+    print(
+        f"\nJSON recuperado: antes {totals['legacy']}/{len(files)}, "
+        f"ahora {totals['new']}/{len(files)} "
+        f"(itinerarios válidos: {totals['valid']})"
+    )
+
+
+if __name__ == "__main__":
+    main()
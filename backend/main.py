@@ -1,9 +1,22 @@
+import asyncio
+from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware  # <--- Importación necesaria
 
+# El .env se carga antes de importar los servicios: leen su configuración
+# (OLLAMA_*, RAG_*, WARM_CACHE_*...) del entorno al importarse
+load_dotenv()
+
 # Import the chat router implemented in `backend/routers/chat.py`
 from routers import chat as chat_router
 from routers import files as files_router
+from services.rag_handler import RAG_EMBED_MODEL, rag_service
+from services.ollama_manager import (
+    OLLAMA_CHAT_MODEL,
+    OLLAMA_PRELOAD,
+    OLLAMA_VISION_MODEL,
+    ollama_manager,
+)
 
 app = FastAPI()
 
@@ -28,6 +41,40 @@ app.include_router(chat_router.router, prefix="/api/chat")
 app.include_router(files_router.router, prefix="/api/files")
 
 
+@app.on_event("startup")
+async def _start_vector_store_maintenance():
+    # GC por TTL + compactación periódica de chroma_db
+    app.state.vector_store_maintenance = asyncio.create_task(
+        rag_service.maintenance_loop()
+    )
+    # Refresco de itinerarios pre-generados (si WARM_CACHE_REFRESH_HOURS > 0).
+    # El router deja warm_cache a None si no se ha podido abrir.
+    warm_cache = chat_router.warm_cache
+    if warm_cache is not None:
+        app.state.warm_cache_refresh = asyncio.create_task(warm_cache.refresh_loop())
+        app.state.warm_cache_demand = asyncio.create_task(warm_cache.demand_flush_loop())
+    if OLLAMA_PRELOAD:
+        # En segundo plano para no retrasar el arranque; el modelo de chat va
+        # el último para que sea el que quede cargado si no caben todos
+        app.state.ollama_preload = asyncio.create_task(
+            asyncio.to_thread(
+                ollama_manager.preload,
+                {
+                    OLLAMA_VISION_MODEL: "generate",
+                    RAG_EMBED_MODEL: "embed",
+                    OLLAMA_CHAT_MODEL: "generate",
+                },
+            )
+        )
+
+
+@app.on_event("shutdown")
+def _flush_warm_cache_demand():
+    # Peticiones contadas desde el último volcado periódico
+    if chat_router.warm_cache is not None:
+        chat_router.warm_cache.flush_demand()
+
+
 
 @app.post("/api/debug")
 async def _debug_body(request: Request):
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+import re
+from enum import Enum
+from pydantic import BaseModel, ConfigDict, field_validator, model_validator
 from typing import Optional, List, Dict, Any
 
 # CLASE 1: La "Hoja de Pedido" (Input)
@@ -12,4 +14,113 @@ class TripRequest(BaseModel):
 # CLASE 2: La "Caja del Producto" (Output)
 # Esto define QUÉ va a devolver el bot a la web.
 class TripResponse(BaseModel):
-    itinerary: str                # OBLIGATORIO: El bot devolverá texto (el JSON de la ruta)
\ No newline at end of file
+    itinerary: str                # OBLIGATORIO: El bot devolverá texto (el JSON de la ruta)
+
+
+# CLASE 3: El itinerario estructurado que genera el modelo (FASE 2, 3 y 4)
+# Sirve para validar/normalizar el JSON antes de guardarlo y mandarlo a la web.
+class Category(str, Enum):
+    CULTURE = "Culture"
+    FOOD = "Food"
+    HIKING = "Hiking"
+    RELAXATION = "Relaxation"
+    SIGHTSEEING = "Sightseeing"
+    GENERAL = "General"
+
+
+def _as_text(value: Any) -> str:
+    """El modelo a veces devuelve números o null donde esperamos texto."""
+    return "" if value is None else str(value)
+
+
+# Alias que acepta el frontend para los campos de una actividad
+ITEM_ALIASES = {
+    "nombre": "activity",
+    "name": "activity",
+    "categoria": "category",
+    "type": "category",
+}
+
+
+class ItineraryItem(BaseModel):
+    model_config = ConfigDict(extra="allow")  # Campos extra del modelo se conservan
+
+    hora: str = ""
+    momento: str = ""
+    activity: str                 # OBLIGATORIO: qué se hace y dónde
+    category: Category = Category.GENERAL
+    detalles: str = ""
+
+    @model_validator(mode="before")
+    @classmethod
+    def _aliases(cls, data: Any) -> Any:
+        # Mismos alias que acepta el frontend (nombre/name, categoria/type)
+        if isinstance(data, str):
+            return {"activity": data}
+        if isinstance(data, dict):
+            data = dict(data)
+            for alias, field in ITEM_ALIASES.items():
+                if not data.get(field) and data.get(alias):
+                    data[field] = data[alias]
+            data.setdefault("activity", "")
+        return data
+
+    @field_validator("hora", "momento", "activity", "detalles", mode="before")
+    @classmethod
+    def _text(cls, value: Any) -> str:
+        return _as_text(value)
+
+    @field_validator("category", mode="before")
+    @classmethod
+    def _category(cls, value: Any) -> Category:
+        # Categoría desconocida o ausente -> "General" (no invalida el itinerario)
+        text = _as_text(value).strip().capitalize()
+        return Category(text) if text in Category._value2member_map_ else Category.GENERAL
+
+
+class ItineraryDay(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    dia: int = 0
+    titulo_dia: str = ""
+    resumen: str = ""
+    itinerario: List[ItineraryItem] = []
+    tip_pro: str = ""
+
+    @field_validator("dia", mode="before")
+    @classmethod
+    def _number(cls, value: Any) -> int:
+        # "Día 1", "1", 1.0... -> 1; sin número -> 0 (Itinerary renumera)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return int(value)
+        match = re.search(r"\d+", _as_text(value))
+        return int(match.group()) if match else 0
+
+    @field_validator("titulo_dia", "resumen", "tip_pro", mode="before")
+    @classmethod
+    def _text(cls, value: Any) -> str:
+        return _as_text(value)
+
+
+class Itinerary(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    titulo: str = ""
+    resumen: str = ""
+    dias: List[ItineraryDay]      # OBLIGATORIO: al menos la lista de días
+
+    @field_validator("titulo", "resumen", mode="before")
+    @classmethod
+    def _text(cls, value: Any) -> str:
+        return _as_text(value)
+
+    @field_validator("dias")
+    @classmethod
+    def _numbered(cls, dias: List[ItineraryDay]) -> List[ItineraryDay]:
+        if not dias:
+            raise ValueError("El itinerario no tiene días")
+        # Días sin número o con numeración rota -> correlativos
+        for number, day in enumerate(dias, 1):
+            if day.dia != number:
+                day.dia = number
+        return dias
@@ -1,10 +1,33 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    HTTPException,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+)
+import asyncio
 import os
 import json
-import re
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from services.llm_engine import get_chat_model
 from services import memory
+from services.itinerary_patch import PatchError, apply_patch
+from services.itinerary_parser import extract_json_object, validate_itinerary
+from services.intent_extractor import extract_intent, has_custom_constraints
+from services.itinerary_prompt import (
+    astream_llm,
+    build_chain,
+    build_human_input,
+    clean_response,
+    invoke_llm,
+)
+from services.session_events import session_events
+from services.conversation_checkpoint import (
+    format_state,
+    needs_checkpoint,
+    schedule_checkpoint,
+    summarize_session,
+)
 
 try:
     from services.rag_handler import rag_service
@@ -12,71 +35,251 @@ except ImportError:
     rag_service = None
     print("⚠️ RAG Handler no encontrado.")
 
+try:
+    from services.warm_cache import warm_cache
+except Exception as e:
+    warm_cache = None
+    print(f"⚠️ Warm cache no disponible: {e}")
+
 router = APIRouter()
 
+# FASE 3: el modelo devuelve un patch sobre el itinerario guardado en vez del JSON completo
+ITINERARY_PATCH_MODE = os.getenv("ITINERARY_PATCH_MODE", "1") != "0"
+
+TECHNICAL_ERROR = {
+    "es_itinerario": False,
+    "mensaje_chat": "Error técnico en el cerebro del asistente.",
+}
+
 
 def parse_user_message(text: str) -> dict:
-    out = {"destination": "", "duration": "", "style": ""}
-    if not text:
-        return out
-
-    text_low = text.lower()
-
-    m = re.search(r"(\d+)\s*d[ií]a", text_low)
-    if m:
-        out["duration"] = m.group(1) + " días"
-
-    styles = [
-        "relax",
-        "aventura",
-        "cultural",
-        "gastronómico",
-        "familia",
-        "lujo",
-        "explorer",
-        "low",
-        "medium",
-        "high",
+    """Destino, duración y estilo detectados en el mensaje (ver services/intent_extractor)."""
+    return extract_intent(text)
+
+
+def _can_use_warm_cache(session_id: str, extra_info: str, session_history: list) -> bool:
+    """
+    Un itinerario pre-generado solo vale si la sesión no ha subido archivos y
+    el usuario no ha pedido nada más allá de destino, duración y estilo.
+    """
+    if memory.get_doc_generation(session_id) > 0:
+        return False
+    checkpoint = memory.get_checkpoint(session_id)
+    if checkpoint["accepted"] or checkpoint["rejected"]:
+        return False
+    user_messages = [extra_info] + [
+        msg.content
+        for msg in session_history
+        if getattr(msg, "type", "") == "human"
     ]
-    for s in styles:
-        if s in text_low:
-            out["style"] = s
-            break
-
-    cities = [
-        "madrid",
-        "barcelona",
-        "sevilla",
-        "valencia",
-        "granada",
-        "bilbao",
-        "malaga",
-        "málaga",
-        "cordoba",
-        "córdoba",
-        "zaragoza",
-        "santiago",
-        "san sebastian",
-        "san sebastián",
-        "ibiza",
-        "mallorca",
-        "tenerife",
-    ]
-    for c in cities:
-        if c in text_low:
-            out["destination"] = c.title()
-            break
+    return not any(has_custom_constraints(str(text)) for text in user_messages)
+
+
+def _prepare_turn(payload: dict) -> dict:
+    """
+    Todo lo que va antes de llamar al modelo: actualiza la memoria del viaje
+    con el mensaje, detecta análisis de archivos / contexto RAG y decide la
+    fase. Lo comparten POST /generate y el WebSocket.
+    """
+    extra_info = (payload.get("extra_info") or payload.get("message") or "").strip()
+    dest_in = (payload.get("destination") or "").strip()
+    dur_in = payload.get("duration")
+    style_in = (payload.get("style") or payload.get("difficulty") or "").strip()
+
+    model_in = (
+        payload.get("model")
+        or payload.get("model_name")
+        or os.getenv("LLM_MODEL", "smart")
+    )
+    session_id = payload.get("session_id") or "user_1"
+
+    session = memory.get_session_data(session_id)
+    _ = session.setdefault(
+        "memory", {"destination": "", "duration": "", "style": ""}
+    )
+
+    if dest_in:
+        memory.update_trip_memory(session_id, dest=dest_in)
+    if dur_in is not None and dur_in != "":
+        memory.update_trip_memory(session_id, dur=dur_in)
+    if style_in:
+        memory.update_trip_memory(session_id, style=style_in)
+
+    parsed = parse_user_message(extra_info)
+    if parsed["destination"] and not dest_in:
+        memory.update_trip_memory(session_id, dest=parsed["destination"])
+    if parsed["duration"] and not dur_in:
+        memory.update_trip_memory(session_id, dur=parsed["duration"])
+    if parsed["style"] and not style_in:
+        memory.update_trip_memory(session_id, style=parsed["style"])
+
+    trip_ctx = memory.get_trip_context(session_id)
+    raw_dest = trip_ctx.get("destination")
+    raw_dur = trip_ctx.get("duration")
+    raw_style = trip_ctx.get("style")
+
+    dest = str(raw_dest).strip() if raw_dest is not None else ""
+    dur = str(raw_dur).strip() if raw_dur is not None else ""
+    style = str(raw_style).strip() if raw_style is not None else ""
+
+    rag_context = ""
+    is_file_analysis = False
+
+    if extra_info and any(
+        keyword in extra_info
+        for keyword in [
+            "[ANÁLISIS",
+            "UBICACIÓN:",
+            "TIPO DE ATRACCIÓN",
+            "📎 ANÁLISIS",
+            "Analizando imagen",
+            "✅ Análisis",
+            "análisis completado",
+        ]
+    ):
+        is_file_analysis = True
+        rag_context = (
+            "📎 ANÁLISIS DE ARCHIVO COMPARTIDO:\n"
+            + "=" * 50
+            + f"\n{extra_info}\n"
+            + "=" * 50
+            + "\n"
+        )
+        print(f"✅ Análisis de archivo detectado: {len(extra_info)} caracteres")
+        extra_info += (
+            "\n\nTen en cuenta que el bloque anterior es un análisis de "
+            "archivo/imagen relacionado con el viaje."
+        )
+
+    elif rag_service and extra_info:
+        try:
+            retrieved = rag_service.retrieve_context(extra_info, session_id, k=3)
+            if retrieved and len(retrieved.strip()) > 20:
+                rag_context += retrieved
+                print("✅ Contexto histórico recuperado desde RAG")
+        except Exception as e:
+            print(f"⚠️ RAG Error: {e}")
+
+    existing_itinerary = memory.get_itinerary(session_id)
+    phase = 1
+
+    if is_file_analysis:
+        phase = 4
+    elif dest and dur:
+        phase = 3 if existing_itinerary else 2
+
+    patch_mode = (
+        phase == 3
+        and ITINERARY_PATCH_MODE
+        and isinstance(existing_itinerary, dict)
+    )
+
+    return {
+        "session_id": session_id,
+        "model": model_in,
+        "extra_info": extra_info,
+        "dest": dest,
+        "dur": dur,
+        "style": style,
+        "rag_context": rag_context,
+        "phase": phase,
+        "existing_itinerary": existing_itinerary,
+        # El historial solo guarda referencias al itinerario: se manda entero
+        # cuando el modelo tiene que trabajar sobre él
+        "current_itinerary": existing_itinerary if phase in (3, 4) else None,
+        "patch_mode": patch_mode,
+        "history": memory.get_prompt_history(session_id),
+        "state": format_state(memory.get_conversation_state(session_id)),
+    }
+
+
+def _turn_input(turn: dict, patch_mode: bool | None = None) -> str:
+    return build_human_input(
+        turn["phase"],
+        turn["dest"],
+        turn["dur"],
+        turn["style"],
+        turn["rag_context"],
+        turn["extra_info"],
+        turn["current_itinerary"],
+        turn["patch_mode"] if patch_mode is None else patch_mode,
+        turn["state"],
+    )
+
+
+def _serve_warm(turn: dict) -> dict | None:
+    """Itinerario pre-generado para la FASE 2 si la petición lo permite."""
+    if (
+        turn["phase"] != 2
+        or warm_cache is None
+        or turn["rag_context"]
+        or not _can_use_warm_cache(
+            turn["session_id"],
+            turn["extra_info"],
+            memory.get_chat_history(turn["session_id"]),
+        )
+    ):
+        return None
+    cached = warm_cache.lookup(turn["dest"], turn["dur"], turn["style"])
+    if cached is None:
+        return None
+    session_id = turn["session_id"]
+    print(f"🔥 Itinerario pre-generado: {turn['dest']} / {turn['dur']} / {turn['style'] or '-'}")
+    memory.set_itinerary(session_id, cached)
+    memory.add_message_to_history(session_id, "user", turn["extra_info"])
+    memory.add_message_to_history(session_id, "ai", memory.itinerary_reference(session_id))
+    return {"es_itinerario": True, **cached}
+
+
+def _resolve_patch(turn: dict, cleaned: str):
+    """
+    Interpreta la respuesta del modelo. En modo patch aplica las operaciones
+    sobre el itinerario guardado. Devuelve (json_obj, regenerar): regenerar es
+    True si el patch no era válido y hay que pedir el itinerario completo.
+    """
+    json_obj = extract_json_object(cleaned)
+    if turn["patch_mode"] and (
+        (json_obj is not None and "patch" in json_obj)
+        or (json_obj is None and '"patch"' in cleaned)
+    ):
+        try:
+            if json_obj is None:
+                raise PatchError("El patch no es un JSON válido")
+            json_obj = apply_patch(turn["existing_itinerary"], json_obj["patch"])
+            print(f"🩹 Patch aplicado: {len(cleaned)} caracteres de salida")
+        except (PatchError, KeyError, TypeError, ValueError) as e:
+            # Patch inválido: regeneramos el itinerario completo
+            print(f"⚠️ Patch inválido ({e}), regenerando itinerario completo")
+            return None, True
+    return json_obj, False
+
+
+def _finish_turn(turn: dict, cleaned: str, json_obj) -> dict:
+    session_id = turn["session_id"]
+    itinerary = validate_itinerary(json_obj) if json_obj is not None else None
+    if itinerary is not None:
+        memory.set_itinerary(session_id, itinerary)
+        # En el historial no se guarda el JSON, solo una referencia compacta
+        memory.add_message_to_history(session_id, "user", turn["extra_info"])
+        memory.add_message_to_history(
+            session_id, "ai", memory.itinerary_reference(session_id)
+        )
+        return {"es_itinerario": True, **itinerary}
 
-    if not out["destination"]:
-        m2 = re.search(r"\bviaje a ([A-Za-zÁÉÍÓÚÑáéíóúñ]+)\b", text_low)
-        if m2:
-            out["destination"] = m2.group(1).title()
+    memory.add_message_to_history(session_id, "user", turn["extra_info"])
+    memory.add_message_to_history(session_id, "ai", cleaned)
+    return {"es_itinerario": False, "mensaje_chat": cleaned}
 
-    return out
+
+@router.get("/warm-cache/stats")
+async def warm_cache_stats() -> dict:
+    if warm_cache is None:
+        raise HTTPException(status_code=503, detail="Warm cache no disponible")
+    return warm_cache.stats()
 
 
 @router.post("/generate")
-async def generate_itinerary(request: Request) -> dict:
+async def generate_itinerary(request: Request, background_tasks: BackgroundTasks) -> dict:
     try:
         try:
             payload = await request.json()
@@ -84,221 +287,21 @@ async def generate_itinerary(request: Request) -> dict:
             raw = await request.body()
             payload = {"extra_info": raw.decode("utf-8", errors="ignore")}
 
-        extra_info = (payload.get("extra_info") or payload.get("message") or "").strip()
-        dest_in = (payload.get("destination") or "").strip()
-        dur_in = payload.get("duration")
-        style_in = (payload.get("style") or payload.get("difficulty") or "").strip()
-
-        model_in = (
-            payload.get("model")
-            or payload.get("model_name")
-            or os.getenv("LLM_MODEL", "smart")
-        )
-        session_id = payload.get("session_id") or "user_1"
-
-        session = memory.get_session_data(session_id)
-        _ = session.setdefault(
-            "memory", {"destination": "", "duration": "", "style": ""}
-        )
-
-        if dest_in:
-            memory.update_trip_memory(session_id, dest=dest_in)
-        if dur_in is not None and dur_in != "":
-            memory.update_trip_memory(session_id, dur=dur_in)
-        if style_in:
-            memory.update_trip_memory(session_id, style=style_in)
-
-        parsed = parse_user_message(extra_info)
-        if parsed["destination"] and not dest_in:
-            memory.update_trip_memory(session_id, dest=parsed["destination"])
-        if parsed["duration"] and not dur_in:
-            memory.update_trip_memory(session_id, dur=parsed["duration"])
-        if parsed["style"] and not style_in:
-            memory.update_trip_memory(session_id, style=parsed["style"])
-
-        trip_ctx = memory.get_trip_context(session_id)
-        raw_dest = trip_ctx.get("destination")
-        raw_dur = trip_ctx.get("duration")
-        raw_style = trip_ctx.get("style")
-
-        dest = str(raw_dest).strip() if raw_dest is not None else ""
-        dur = str(raw_dur).strip() if raw_dur is not None else ""
-        style = str(raw_style).strip() if raw_style is not None else ""
-
-        rag_context = ""
-        is_file_analysis = False
-
-        if extra_info and any(
-            keyword in extra_info
-            for keyword in [
-                "[ANÁLISIS",
-                "UBICACIÓN:",
-                "TIPO DE ATRACCIÓN",
-                "📎 ANÁLISIS",
-                "Analizando imagen",
-                "✅ Análisis",
-                "análisis completado",
-            ]
-        ):
-            is_file_analysis = True
-            rag_context = (
-                "📎 ANÁLISIS DE ARCHIVO COMPARTIDO:\n"
-                + "=" * 50
-                + f"\n{extra_info}\n"
-                + "=" * 50
-                + "\n"
-            )
-            print(f"✅ Análisis de archivo detectado: {len(extra_info)} caracteres")
-            extra_info += (
-                "\n\nTen en cuenta que el bloque anterior es un análisis de "
-                "archivo/imagen relacionado con el viaje."
-            )
-
-        elif rag_service and extra_info:
-            try:
-                retrieved = rag_service.retrieve_context(extra_info, session_id, k=3)
-                if retrieved and len(retrieved.strip()) > 20:
-                    rag_context += retrieved
-                    print("✅ Contexto histórico recuperado desde RAG")
-            except Exception as e:
-                print(f"⚠️ RAG Error: {e}")
-
-        existing_itinerary = memory.get_itinerary(session_id)
-        phase = 1
+        # Recuperación RAG y LLM en hilos: esperan turno en el planificador de
+        # Ollama y no deben bloquear el event loop (WebSockets, otras peticiones)
+        turn = await asyncio.to_thread(_prepare_turn, payload)
+        cached = _serve_warm(turn)
+        if cached is not None:
+            return cached
 
-        if is_file_analysis:
-            phase = 4
-        elif dest and dur:
-            phase = 3 if existing_itinerary else 2
-
-        session_history = memory.get_chat_history(session_id)
+        session_history = turn["history"]
         response_text: str | None = None
 
         try:
-            llm, provider = get_chat_model(model_in)
-            print(f"🛰️ Usando proveedor: {provider} (modelo: {model_in})")
-
-            # IMPORTANTE: llaves del JSON de ejemplo escapadas con {{ }}
-            system_prompt = """### ROL Y OBJETIVO
-Actúa como "Atlas", un Asistente de Viajes de Clase Mundial y experto en logística turística. Tu objetivo es diseñar itinerarios de viaje hiper-personalizados, lógicos y factibles.
-
-SIEMPRE recibirás una variable `FASE_ACTUAL` en el mensaje del usuario. Debes comportarte así:
-
-- FASE_ACTUAL = 1 (Perfilado):
-  - Tu tarea es SOLO hacer preguntas y completar los "Pilares del Viaje".
-  - No generes todavía un itinerario completo ni devuelvas JSON.
-  - Sé muy concreto y no alargues la respuesta.
-
-- FASE_ACTUAL = 2 (Generación de Itinerario):
-  - Si faltan datos críticos (destino o duración), pide esos datos primero, de forma breve.
-  - Si ya tienes información suficiente, GENERA un itinerario completo.
-  - La respuesta debe ser EXCLUSIVAMENTE un JSON válido, sin ningún texto antes ni después.
-
-- FASE_ACTUAL = 3 (Modificación / Regeneración):
-  - Asume que ya existe un itinerario previo (presente en el historial).
-  - El usuario puede pedir cambios ("quita museos", "añade más playa", etc.).
-  - Devuelve SIEMPRE un itinerario COMPLETO en formato JSON, ya ajustado, sin texto adicional.
-
-- FASE_ACTUAL = 4 (Análisis de Archivos/Imágenes):
-  - Integra el contenido del bloque etiquetado como análisis de archivo/imágenes en la lógica del viaje (vuelos, reservas, fotos...).
-  - Puedes hacer preguntas adicionales si faltan datos críticos.
-  - Cuando generes itinerario, hazlo igual que en FASE 2/3: SOLO JSON.
-
-### PILARES DEL VIAJE
-Debes conocer y usar:
-- Destino (ciudad/región).
-- Duración (número de días).
-- Presupuesto/estilo (mochilero, medio, lujo, relaxed, adventure...).
-- Compañía (solo, pareja, familia con niños, amigos).
-- Intereses (gastronomía, historia, aventura, relax, etc.).
-
-### FORMATO JSON DEL ITINERARIO
-Cuando generes el itinerario (FASE 2, 3 o 4), tu respuesta debe ser SOLO este JSON:
-
-{{
-  "titulo": "Nombre Creativo del Viaje",
-  "resumen": "Breve descripción del estilo del viaje",
-  "dias": [
-    {{
-      "dia": 1,
-      "titulo_dia": "Título descriptivo del día",
-      "resumen": "Breve resumen del día",
-      "itinerario": [
-        {{
-          "hora": "09:00",
-          "momento": "Mañana",
-          "activity": "Actividad + Ubicación",
-          "category": "Sightseeing",
-          "detalles": "Nota logística: cómo llegar, duración aproximada"
-        }},
-        {{
-          "hora": "13:00",
-          "momento": "Almuerzo",
-          "activity": "Recomendación específica de restaurante",
-          "category": "Food",
-          "detalles": "Precio estimado en función del estilo/presupuesto"
-        }},
-        {{
-          "hora": "15:00",
-          "momento": "Tarde",
-          "activity": "Actividad + Ubicación",
-          "category": "Culture",
-          "detalles": "Nota logística"
-        }},
-        {{
-          "hora": "20:00",
-          "momento": "Noche",
-          "activity": "Cena o plan nocturno",
-          "category": "Food",
-          "detalles": "Recomendación especial"
-        }}
-      ],
-      "tip_pro": "Consejo logístico o local"
-    }}
-  ]
-}}
-
-Categorías válidas en "category": "Culture", "Food", "Hiking", "Relaxation", "Sightseeing", "General".
-
-### REGLAS DE ORO
-- Sé realista: evita meter demasiadas actividades en poco tiempo.
-- Ten en cuenta desplazamientos y cansancio.
-- Tono: profesional y directo, evita la prosa larga.
-- Respeta SIEMPRE FASE_ACTUAL:
-  - FASE 1: NUNCA JSON.
-  - FASE 2, 3, 4 cuando generes itinerario: SOLO JSON.
-"""
-
-            human_input = f"""FASE_ACTUAL: {phase}
-
-📋 CONTEXTO DEL VIAJE (MEMORIA):
-- Destino: {dest or "NO_ESPECIFICADO"}
-- Duración: {dur or "NO_ESPECIFICADA"}
-- Estilo/Presupuesto: {style or "NO_ESPECIFICADO"}
-
-📎 CONTEXTO ADICIONAL:
-{rag_context or "(sin contexto externo adicional)"}
-
-💬 MENSAJE DEL USUARIO:
-{extra_info}
-"""
-
-            prompt_template = ChatPromptTemplate.from_messages(
-                [
-                    ("system", system_prompt),
-                    MessagesPlaceholder(variable_name="chat_history"),
-                    ("human", "{input}"),
-                ]
-            )
-
-            chain = prompt_template | llm
-            response_obj = chain.invoke(
-                {"input": human_input, "chat_history": session_history}
-            )
-            response_text = (
-                response_obj.content
-                if hasattr(response_obj, "content")
-                else str(response_obj)
+            llm, provider = get_chat_model(turn["model"])
+            print(f"🛰️ Usando proveedor: {provider} (modelo: {turn['model']})")
+            response_text = await asyncio.to_thread(
+                invoke_llm, llm, _turn_input(turn), session_history
             )
 
         except Exception as e:
@@ -306,34 +309,211 @@ Categorías válidas en "category": "Culture", "Food", "Hiking", "Relaxation", "
             response_text = None
 
         if not response_text:
-            return {
-                "es_itinerario": False,
-                "mensaje_chat": "Error técnico en el cerebro del asistente.",
-            }
+            return dict(TECHNICAL_ERROR)
 
-        cleaned = response_text.replace("```json", "").replace("```", "").strip()
-        memory.add_message_to_history(session_id, "user", extra_info)
-        memory.add_message_to_history(session_id, "ai", cleaned)
+        cleaned = clean_response(response_text)
+        json_obj, regenerate = _resolve_patch(turn, cleaned)
 
-        json_obj = None
-        try:
-            json_obj = json.loads(cleaned)
-        except Exception:
-            start = cleaned.find("{")
-            end = cleaned.rfind("}")
-            if start != -1 and end != -1 and end > start:
-                candidate = cleaned[start : end + 1]
-                try:
-                    json_obj = json.loads(candidate)
-                except Exception as e:
-                    print(f"⚠️ Error parseando JSON de itinerario: {e}")
-
-        if json_obj is not None and isinstance(json_obj, dict):
-            memory.set_itinerary(session_id, json_obj)
-            return {"es_itinerario": True, **json_obj}
-
-        return {"es_itinerario": False, "mensaje_chat": cleaned}
+        if regenerate:
+            try:
+                response_text = await asyncio.to_thread(
+                    invoke_llm, llm, _turn_input(turn, patch_mode=False), session_history
+                )
+            except Exception as llm_e:
+                print(f"⚠️ Llamada al LLM falló: {llm_e}")
+                return dict(TECHNICAL_ERROR)
+            cleaned = clean_response(response_text)
+            json_obj = extract_json_object(cleaned)
+
+        result = _finish_turn(turn, cleaned, json_obj)
+        if needs_checkpoint(turn["session_id"], result["es_itinerario"]):
+            # Se resume con el modelo rápido cuando la respuesta ya se ha enviado
+            background_tasks.add_task(summarize_session, turn["session_id"])
+        return result
 
     except Exception as e:
         print(f"❌ Error en /generate: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+class ChatConnection:
+    """
+    Estado de una conexión WebSocket de chat. Durante toda la conexión se
+    reutilizan el cliente del modelo y su cadena prompt|llm (uno por modelo
+    usado), en vez de resolverlos en cada turno. Los datos de la sesión se
+    leen de `memory` en cada turno: la sesión se puede borrar o resetear
+    mientras el socket sigue abierto.
+
+    Solo hay una generación en curso por conexión: un mensaje nuevo (o un
+    {"type": "cancel"}) cancela la anterior, que deja de consumir tokens y no
+    se guarda en el historial.
+    """
+
+    def __init__(self, websocket: WebSocket, session_id: str, model_name: str):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.model_name = model_name
+        self._chains: dict = {}
+        self._turn = 0
+        self._generation: asyncio.Task | None = None
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, event: dict):
+        # El stream de tokens y los eventos de subida comparten el socket
+        async with self._send_lock:
+            await self.websocket.send_json(event)
+
+    def _chain(self, model_name: str):
+        if model_name not in self._chains:
+            llm, provider = get_chat_model(model_name)
+            print(f"🛰️ WebSocket {self.session_id}: proveedor {provider} (modelo: {model_name})")
+            self._chains[model_name] = (build_chain(llm), provider)
+        return self._chains[model_name]
+
+    async def _stream(self, turn_id: int, chain, human_input: str, history: list) -> str:
+        parts = []
+        async for text in astream_llm(chain, human_input, history):
+            parts.append(text)
+            await self.send({"type": "token", "turn": turn_id, "text": text})
+        return "".join(parts)
+
+    async def _generate(self, turn_id: int, data: dict):
+        payload = {**data, "session_id": self.session_id, "model": self.model_name}
+        try:
+            # retrieve_context es bloqueante (embeddings + ChromaDB)
+            turn = await asyncio.to_thread(_prepare_turn, payload)
+            cached = _serve_warm(turn)
+            if cached is not None:
+                await self.send({"type": "result", "turn": turn_id, **cached})
+                return
+
+            try:
+                chain, provider = self._chain(turn["model"])
+                await self.send(
+                    {"type": "start", "turn": turn_id, "phase": turn["phase"], "provider": provider}
+                )
+                response_text = await self._stream(
+                    turn_id, chain, _turn_input(turn), turn["history"]
+                )
+            except Exception as e:
+                print(f"⚠️ Llamada al LLM falló: {e}")
+                response_text = None
+
+            if not response_text:
+                await self.send({"type": "result", "turn": turn_id, **TECHNICAL_ERROR})
+                return
+
+            cleaned = clean_response(response_text)
+            json_obj, regenerate = _resolve_patch(turn, cleaned)
+            if regenerate:
+                # El cliente descarta lo recibido y pinta la regeneración
+                await self.send({"type": "restart", "turn": turn_id})
+                try:
+                    response_text = await self._stream(
+                        turn_id, chain, _turn_input(turn, patch_mode=False), turn["history"]
+                    )
+                except Exception as e:
+                    print(f"⚠️ Llamada al LLM falló: {e}")
+                    await self.send({"type": "result", "turn": turn_id, **TECHNICAL_ERROR})
+                    return
+                cleaned = clean_response(response_text)
+                json_obj = extract_json_object(cleaned)
+
+            result = _finish_turn(turn, cleaned, json_obj)
+            await self.send({"type": "result", "turn": turn_id, **result})
+            if needs_checkpoint(self.session_id, result["es_itinerario"]):
+                schedule_checkpoint(self.session_id)
+
+        except asyncio.CancelledError:
+            raise
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            print(f"❌ Error en WebSocket {self.session_id}: {e}")
+            try:
+                await self.send({"type": "error", "turn": turn_id, "error": str(e)})
+            except Exception:
+                pass
+
+    async def cancel(self) -> bool:
+        """Cancela la generación en curso (si la hay) y espera a que termine."""
+        task = self._generation
+        self._generation = None
+        if task is None or task.done():
+            return False
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await self.send({"type": "cancelled", "turn": self._turn})
+        print(f"🛑 WebSocket {self.session_id}: generación {self._turn} cancelada")
+        return True
+
+    async def _push_session_events(self, events: asyncio.Queue):
+        while True:
+            event = await events.get()
+            await self.send({"type": "upload", **event})
+
+    async def run(self):
+        events = session_events.subscribe(self.session_id)
+        pusher = asyncio.create_task(self._push_session_events(events))
+        await self.send(
+            {"type": "ready", "session_id": self.session_id, "model": self.model_name}
+        )
+        try:
+            while True:
+                raw = await self.websocket.receive_text()
+                try:
+                    data = json.loads(raw)
+                except ValueError:
+                    data = {"type": "message", "extra_info": raw}
+                if not isinstance(data, dict):
+                    await self.send({"type": "error", "error": "Se esperaba un objeto JSON"})
+                    continue
+
+                kind = data.get("type", "message")
+                if kind == "cancel":
+                    await self.cancel()
+                elif kind == "message":
+                    await self.cancel()
+                    if data.get("model"):
+                        self.model_name = data["model"]
+                    self._turn += 1
+                    self._generation = asyncio.create_task(
+                        self._generate(self._turn, data)
+                    )
+                elif kind == "ping":
+                    await self.send({"type": "pong"})
+                else:
+                    await self.send({"type": "error", "error": f"Tipo de mensaje desconocido: {kind!r}"})
+        except WebSocketDisconnect:
+            print(f"🔌 WebSocket {self.session_id} desconectado")
+        finally:
+            if self._generation is not None:
+                self._generation.cancel()
+            pusher.cancel()
+            session_events.unsubscribe(self.session_id, events)
+
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    """
+    Chat por WebSocket (ws://.../api/chat/ws?session_id=...&model=...).
+
+    Cliente -> servidor:
+    - {"type": "message", "extra_info": "...", ...}: mismos campos que /generate.
+      Cancela la generación anterior si sigue en curso.
+    - {"type": "cancel"}: cancela la generación en curso.
+    - {"type": "ping"}
+
+    Servidor -> cliente:
+    - "ready", "start", "token" (trozo de texto), "restart" (el patch no era
+      válido y se regenera el itinerario), "result" (mismo JSON que
+      /generate), "cancelled", "error", "pong".
+    - "upload": eventos de análisis de archivos subidos en la sesión.
+    """
+    await websocket.accept()
+    session_id = websocket.query_params.get("session_id") or "user_1"
+    model_name = websocket.query_params.get("model") or os.getenv("LLM_MODEL", "smart")
+    await ChatConnection(websocket, session_id, model_name).run()
@@ -1,5 +1,10 @@
+import asyncio
+import json
+from typing import List
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
 from services.rag_handler import rag_service
+from services.session_events import session_events
 
 router = APIRouter()
 
@@ -18,6 +23,9 @@ async def upload_file(
     - PDFs: extrae texto y analiza con LLM.
     - Documentos: TXT, MD, JSON, CSV → Análisis directo.
 
+    El tipo se comprueba por el contenido y hay un tamaño máximo por tipo
+    (UPLOAD_MAX_MB_*): si no cuadra se responde 415/413 sin analizar nada.
+
     Devuelve el análisis COMPLETO listo para utilizar en el chat/itinerario.
     """
     try:
@@ -33,7 +41,8 @@ async def upload_file(
             print(f"❌ ERROR: {result.get('error')}")
             print("=" * 60 + "\n")
             raise HTTPException(
-                status_code=400, detail=result.get("error", "Error desconocido")
+                status_code=result.get("status_code", 400),
+                detail=result.get("error", "Error desconocido"),
             )
 
         print("✅ ANÁLISIS COMPLETADO")
@@ -41,8 +50,7 @@ async def upload_file(
         print(f"Estado: {result.get('status')}")
         print("=" * 60 + "\n")
 
-        # Devolvemos análisis DIRECTO
-        return {
+        response = {
             "ok": True,
             "filename": result.get("filename"),
             "file_type": result.get("file_type"),
@@ -52,6 +60,12 @@ async def upload_file(
             "status": result.get("status"),
             "ready_for_chat": result.get("ready_for_chat"),
         }
+        # Aviso a los chats abiertos por WebSocket en esta sesión
+        session_events.publish(session_id, {"event": "file", "index": 0, **response})
+        session_events.publish(session_id, {"event": "done", "ok": True, "files": 1, "analyzed": 1})
+
+        # Devolvemos análisis DIRECTO
+        return response
 
     except HTTPException:
         raise
@@ -61,3 +75,71 @@ async def upload_file(
 
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@router.post("/upload/batch")
+async def upload_files(
+    files: List[UploadFile] = File(...),
+    session_id: str = Form(...),
+    model: str | None = Form(None),
+):
+    """
+    Recibe VARIOS archivos en una sola petición y los analiza en paralelo.
+
+    Responde en streaming NDJSON (una línea JSON por evento):
+    - {"event": "file", "index": i, ...}: resultado de cada archivo en cuanto
+      termina (mismos campos que /upload, o "ok": false y "error").
+    - {"event": "done", ...}: resumen final, tras indexar todos los fragmentos
+      en ChromaDB de una vez.
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No se ha enviado ningún archivo")
+
+    print("\n" + "=" * 60)
+    print(f"📥 PROCESANDO LOTE DE {len(files)} ARCHIVOS")
+    print("=" * 60 + "\n")
+
+    # Se guardan antes de responder: FastAPI cierra los UploadFile al salir del endpoint
+    saved = await rag_service.save_uploads(files)
+
+    async def _events():
+        try:
+            async for event in rag_service.process_files(saved, session_id, model):
+                session_events.publish(session_id, event)
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"❌ ERROR EN /upload/batch: {e}")
+            yield json.dumps({"event": "error", "ok": False, "error": str(e)}) + "\n"
+
+    return StreamingResponse(_events(), media_type="application/x-ndjson")
+
+
+@router.get("/cache/stats")
+async def retrieval_cache_stats():
+    """Métricas de la caché de recuperación RAG (aciertos, fallos, expulsiones)."""
+    return rag_service.retrieval_cache.stats()
+
+
+@router.get("/stats")
+async def vector_store_stats():
+    """Tamaño del vector store, sesiones indexadas y latencia de las consultas."""
+    # Recorre los metadatos de todos los fragmentos: fuera del event loop
+    return await asyncio.to_thread(rag_service.stats)
+
+
+@router.delete("/session/{session_id}")
+async def delete_session_files(session_id: str):
+    """Elimina del vector store todos los fragmentos de una sesión."""
+    try:
+        # Espera el lock del índice (una compactación lo retiene mucho rato)
+        deleted = await asyncio.to_thread(rag_service.delete_session, session_id)
+        return {"ok": True, "session_id": session_id, "deleted_chunks": deleted}
+    except Exception as e:
+        print(f"❌ ERROR EN DELETE /session: {e}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@router.post("/maintenance")
+async def run_vector_store_maintenance():
+    """Lanza a mano el GC por TTL y la compactación del índice."""
+    return await asyncio.to_thread(rag_service.run_maintenance)
@@ -0,0 +1,50 @@
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class ProjectedEmbeddings(Embeddings):
+    """
+    Envuelve un modelo de embeddings y reduce la dimensión de sus vectores
+    con una proyección aleatoria gaussiana fija (Johnson-Lindenstrauss).
+
+    La matriz depende solo de la dimensión de entrada, `dim` y `seed`, así que
+    los vectores guardados siguen siendo válidos entre reinicios mientras no
+    cambien esos tres valores. Los vectores salen normalizados (norma 1).
+    """
+
+    def __init__(self, base: Embeddings, dim: int, seed: int = 42):
+        self.base = base
+        self.dim = dim
+        self.seed = seed
+        self._matrix: np.ndarray | None = None
+
+    def _projection(self, in_dim: int) -> np.ndarray:
+        if self._matrix is None or self._matrix.shape[0] != in_dim:
+            if self.dim >= in_dim:
+                raise ValueError(
+                    f"RAG_EMBED_DIM={self.dim} debe ser menor que la dimensión "
+                    f"del modelo ({in_dim})"
+                )
+            rng = np.random.default_rng(self.seed)
+            self._matrix = (
+                rng.standard_normal((in_dim, self.dim)).astype(np.float32)
+                / np.sqrt(self.dim)
+            )
+        return self._matrix
+
+    def project(self, vectors: List[List[float]]) -> List[List[float]]:
+        if not vectors:
+            return []
+        arr = np.asarray(vectors, dtype=np.float32)
+        reduced = arr @ self._projection(arr.shape[1])
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (reduced / norms).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.project(self.base.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.project([self.base.embed_query(text)])[0]
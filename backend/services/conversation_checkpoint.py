@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import threading
+from typing import Any, Dict, List
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from services import memory
+from services.itinerary_parser import extract_json_object
+from services.llm_engine import get_chat_model
+
+# Modelo barato para resumir (se ejecuta después de responder al usuario).
+# Si no se puede usar (p. ej. "fast" sin GROQ_API_KEY) se resume con el local.
+CHECKPOINT_MODEL = os.getenv("CHECKPOINT_MODEL", "fast")
+# Mensajes recientes que nunca se resumen (se quedan tal cual en el historial)
+CHECKPOINT_KEEP_MESSAGES = int(os.getenv("CHECKPOINT_KEEP_MESSAGES", "4"))
+# Sin itinerario nuevo, se resume cuando hay al menos estos mensajes antiguos
+CHECKPOINT_MIN_MESSAGES = int(os.getenv("CHECKPOINT_MIN_MESSAGES", "6"))
+CHECKPOINT_MAX_ITEMS = 15
+CHECKPOINT_MAX_NOTES = 600
+
+SUMMARY_SYSTEM_PROMPT = """Resumes conversaciones de planificación de viajes para un asistente.
+Recibes el ESTADO anterior y los TURNOS nuevos. Devuelve SOLO un JSON con el estado actualizado:
+
+{{"aceptadas": ["..."], "rechazadas": ["..."], "notas": "..."}}
+
+- aceptadas: preferencias o cambios que el usuario ha pedido o aprobado (frases cortas).
+- rechazadas: cosas que el usuario no quiere o ha pedido quitar.
+- notas: datos útiles que no encajan arriba (compañía, fechas, restricciones), máximo 2 frases.
+- Si algo pasa de aceptado a rechazado (o al revés), muévelo; no lo repitas en ambas listas.
+- No incluyas el itinerario: ya se guarda aparte.
+"""
+
+_SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
+    [("system", SUMMARY_SYSTEM_PROMPT), ("human", "{input}")]
+)
+
+# Sesiones con un resumen en curso (no se lanzan dos a la vez)
+_running: set = set()
+_running_lock = threading.Lock()
+_background_tasks: set = set()
+
+
+def format_state(state: Dict[str, Any]) -> str:
+    """Bloque de texto del estado de la conversación para el prompt ("" si está vacío)."""
+    lines = []
+    if state.get("itinerary"):
+        lines.append(f"- Itinerario vigente: {state['itinerary']}")
+    if state.get("accepted"):
+        lines.append("- Preferencias aceptadas: " + "; ".join(state["accepted"]))
+    if state.get("rejected"):
+        lines.append("- Preferencias rechazadas: " + "; ".join(state["rejected"]))
+    if state.get("notes"):
+        lines.append(f"- Notas: {state['notes']}")
+    return "\n".join(lines)
+
+
+def _clean_items(value: Any) -> List[str]:
+    if not isinstance(value, list):
+        return []
+    items = []
+    for item in value:
+        text = str(item).strip()
+        if text and text not in items:
+            items.append(text)
+    return items[-CHECKPOINT_MAX_ITEMS:]
+
+
+def _turns_text(messages: list) -> str:
+    lines = []
+    for msg in messages:
+        who = "Usuario" if getattr(msg, "type", "") == "human" else "Asistente"
+        lines.append(f"{who}: {msg.content}")
+    return "\n".join(lines)
+
+
+def needs_checkpoint(session_id: str, new_itinerary: bool) -> bool:
+    older = len(memory.get_chat_history(session_id)) - CHECKPOINT_KEEP_MESSAGES
+    return older > 0 and (new_itinerary or older >= CHECKPOINT_MIN_MESSAGES)
+
+
+def _summary_model():
+    try:
+        return get_chat_model(CHECKPOINT_MODEL)
+    except RuntimeError as e:
+        print(f"⚠️ Checkpoint: modelo '{CHECKPOINT_MODEL}' no disponible ({e}); se usa el local")
+        return get_chat_model("local")
+
+
+def summarize_session(session_id: str) -> bool:
+    """
+    Resume los mensajes antiguos de la sesión en el checkpoint y los quita del
+    historial. Bloqueante: pensado para ejecutarse en segundo plano. Si el
+    modelo falla, el historial se queda como estaba.
+    """
+    with _running_lock:
+        if session_id in _running:
+            return False
+        _running.add(session_id)
+
+    try:
+        history = memory.get_chat_history(session_id)
+        count = len(history) - CHECKPOINT_KEEP_MESSAGES
+        if count <= 0:
+            return False
+        older = history[:count]
+        previous = memory.get_checkpoint(session_id)
+
+        human_input = (
+            "ESTADO:\n"
+            + json.dumps(
+                {
+                    "aceptadas": previous["accepted"],
+                    "rechazadas": previous["rejected"],
+                    "notas": previous["notes"],
+                },
+                ensure_ascii=False,
+            )
+            + "\n\nTURNOS:\n"
+            + _turns_text(older)
+        )
+
+        llm, provider = _summary_model()
+        response = (_SUMMARY_PROMPT | llm).invoke({"input": human_input})
+        text = response.content if hasattr(response, "content") else str(response)
+        summary = extract_json_object(text)
+        if summary is None:
+            print(f"⚠️ Checkpoint {session_id}: respuesta sin JSON, se reintentará")
+            return False
+
+        checkpoint = {
+            "accepted": _clean_items(summary.get("aceptadas")),
+            "rejected": _clean_items(summary.get("rechazadas")),
+            "notes": str(summary.get("notas") or "").strip()[:CHECKPOINT_MAX_NOTES],
+            "summarized_messages": previous.get("summarized_messages", 0),
+        }
+        if not memory.collapse_history(session_id, history, count, checkpoint):
+            return False
+        print(
+            f"🧭 Checkpoint {session_id}: {count} mensajes resumidos con {provider} "
+            f"({len(checkpoint['accepted'])} aceptadas, {len(checkpoint['rejected'])} rechazadas)"
+        )
+        return True
+
+    except Exception as e:
+        print(f"⚠️ Error resumiendo la sesión {session_id}: {e}")
+        return False
+    finally:
+        with _running_lock:
+            _running.discard(session_id)
+
+
+def schedule_checkpoint(session_id: str):
+    """Lanza `summarize_session` en segundo plano desde el event loop."""
+    task = asyncio.create_task(asyncio.to_thread(summarize_session, session_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
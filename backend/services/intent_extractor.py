@@ -0,0 +1,343 @@
+import os
+import re
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Gazetteer por defecto (incluido en el repo). GAZETTEER_PATH permite cargar
+# uno más grande: mismo formato TSV o un volcado de ciudades de GeoNames
+# (p. ej. cities15000.txt).
+DEFAULT_GAZETTEER = Path(__file__).resolve().parent.parent / "data" / "gazetteer.tsv"
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "")
+# En volcados de GeoNames, solo ciudades con al menos esta población
+GAZETTEER_MIN_POPULATION = int(os.getenv("GAZETTEER_MIN_POPULATION", "15000"))
+
+# Prioridad cuando el mensaje menciona varios destinos: la ciudad manda
+KIND_PRIORITY = {"city": 0, "region": 1, "country": 2}
+
+# Palabras corrientes que también son topónimos: nunca se usan como alias
+COMMON_WORDS = {
+    "a", "al", "como", "con", "de", "del", "dos", "el", "en", "era", "es",
+    "esta", "este", "hay", "la", "las", "lo", "los", "mar", "mas", "mi",
+    "no", "nos", "para", "por", "que", "se", "si", "sin", "sol", "su",
+    "tres", "un", "una", "uno", "ver", "vez", "ya", "casa", "playa", "rio",
+    "puerto", "villa", "san", "santa", "nice", "bath", "reading", "mayo",
+    "paz", "victoria", "buena", "buenas", "amor", "luz", "cruz", "faro",
+    "potes", "split", "centro", "norte", "sur", "este", "oeste", "costa",
+}
+
+# Topónimos que también son palabras corrientes ("¿qué tarifa tiene?", "una
+# ronda de tapas"): solo cuentan con mayúscula o detrás de una preposición de lugar
+AMBIGUOUS_WORDS = {"tarifa", "ronda", "leon", "cuenca", "palma", "lima", "pisa"}
+PLACE_PREPOSITIONS = {"a", "en", "por"}
+# Con varios destinos del mismo tipo manda el que va detrás de "a"/"en"
+TARGET_PREPOSITIONS = {"a", "en"}
+
+# Estilos: alias (sin acentos) -> estilo canónico (mismos valores que antes)
+STYLE_ALIASES = {
+    "relax": ["relax", "relajado", "relajante", "tranquilo", "descanso", "descansar", "desconectar"],
+    "aventura": ["aventura", "aventurero", "adrenalina", "senderismo", "trekking", "rutas de montana"],
+    "cultural": ["cultural", "cultura", "museos", "historia", "historico", "monumentos", "arte"],
+    "gastronómico": ["gastronomico", "gastronomia", "gastro", "tapas", "comer bien", "foodie", "vinos", "enoturismo"],
+    "familia": ["familia", "familiar", "con ninos", "ninos", "hijos", "peques"],
+    "lujo": ["lujo", "lujoso", "premium", "cinco estrellas", "5 estrellas", "vip"],
+    "explorer": ["explorer", "explorar", "explorador", "mochilero", "mochila"],
+    "low": ["low", "low cost", "lowcost", "barato", "economico", "bajo presupuesto", "presupuesto bajo", "poco dinero"],
+    "medium": ["medium", "presupuesto medio", "precio medio", "gama media"],
+    "high": ["high", "presupuesto alto", "alto presupuesto", "sin limite de presupuesto"],
+}
+
+# Un estilo precedido de estas palabras (saltando relleno) está negado:
+# "sin museos", "no quiero niños", "nada de lujo", y las peticiones de quitar
+# algo del itinerario ("quita museos", "elimina los museos", "evita el lujo")
+NEGATION_WORDS = {
+    "sin", "no", "ni", "nada", "menos", "fuera", "excepto", "salvo",
+    "quita", "quitar", "quitame", "quitale", "quitad", "quitamos",
+    "elimina", "eliminar", "eliminame", "eliminad", "borra", "borrar", "borrame",
+    "evita", "evitar", "evitame", "evitad", "sobra", "sobran",
+}
+
+# Palabras de relleno de una petición "normal" (destino + días + estilo).
+# Cualquier otra palabra se considera una preferencia/restricción propia.
+FILLER_WORDS = {
+    "hola", "buenas", "buenos", "dias", "dia", "d", "noche", "noches", "semana",
+    "semanas", "fin", "finde", "puente", "quiero", "queremos", "quisiera",
+    "quisieramos", "me", "nos", "gustaria", "apetece", "encantaria", "hacer",
+    "ir", "irme", "irnos", "viajar", "viaje", "escapada", "vacaciones", "plan",
+    "planear", "planifica", "planificar", "organiza", "organizar", "organizame",
+    "itinerario", "ruta", "visitar", "conocer", "ver", "a", "al", "en", "de",
+    "del", "por", "para", "la", "el", "los", "las", "un", "una", "unos", "unas",
+    "y", "o", "mi", "dame", "haz", "hazme", "crea", "creame", "genera",
+    "generame", "puedes", "podrias", "favor", "porfa", "gracias", "algo",
+    "tipo", "estilo", "durante", "que", "sea", "es", "presupuesto", "total",
+    "vale", "ok", "si", "perfecto", "genial", "pensando", "estoy", "estamos",
+}
+
+NUMBER_WORDS = {
+    "un": 1, "una": 1, "uno": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "once": 11,
+    "doce": 12, "trece": 13, "catorce": 14, "quince": 15, "veinte": 20,
+}
+_NUM = r"(\d{1,2}|" + "|".join(NUMBER_WORDS) + r")"
+
+# Patrones de duración sobre texto normalizado (sin acentos, minúsculas)
+_DURATION_PATTERNS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(rf"\b{_NUM}\s*(?:dias?|d)\b"), "days"),
+    (re.compile(rf"\b{_NUM}\s*noches?\b"), "nights"),
+    (re.compile(rf"\b{_NUM}\s*semanas?\b"), "weeks"),
+    (re.compile(r"\bfin de semana\b|\bfinde\b|\bpuente\b"), "weekend"),
+]
+
+# Plan B de siempre si el gazetteer no conoce el destino
+_TRAVEL_TO = re.compile(
+    r"\b(?:viaje|viajar|escapada|vacaciones)\s+(?:a|en|por)\s+([a-záéíóúüñ]+)"
+)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_CASED_TOKEN_RE = re.compile(r"[A-Za-z0-9]+")
+_END = "\0"
+
+
+def _strip_accents(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def normalize(text: str) -> str:
+    """Minúsculas y sin acentos (para comparar topónimos escritos de cualquier forma)."""
+    return _strip_accents(text.lower())
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(normalize(text))
+
+
+class IntentExtractor:
+    """
+    Extrae destino, duración y estilo de un mensaje del usuario.
+
+    Los topónimos y estilos se compilan en un trie de palabras: cada alias es
+    una secuencia de tokens, así que las coincidencias respetan siempre los
+    límites de palabra ("low" no salta dentro de "follow"). El mensaje se
+    recorre una vez probando el trie desde cada token y se queda con la
+    coincidencia más larga.
+    """
+
+    def __init__(self):
+        self._trie: Dict[str, dict] = {}
+        self.places = 0
+        # Palabras que el plan B "viaje a X" nunca debe tomar como destino
+        self._excluded_words = set(COMMON_WORDS)
+
+    # -- construcción --------------------------------------------------
+
+    def add(self, alias: str, payload: Tuple[str, str, str]):
+        """`payload` = (tipo, valor canónico, subtipo)."""
+        tokens = tokenize(alias)
+        if not tokens:
+            return
+        if len(tokens) == 1 and (tokens[0] in COMMON_WORDS or len(tokens[0]) < 3):
+            return
+        node = self._trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        # Si dos topónimos comparten alias, se queda el primero (el más relevante)
+        node.setdefault(_END, payload)
+
+    def add_place(self, name: str, kind: str, aliases: List[str]):
+        payload = ("destination", name, kind)
+        self.add(name, payload)
+        for alias in aliases:
+            self.add(alias, payload)
+        self.places += 1
+
+    def load_tsv(self, path: Path):
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                line = line.rstrip("\n")
+                if not line.strip() or line.startswith("#"):
+                    continue
+                cols = line.split("\t")
+                if len(cols) >= 15:
+                    self._add_geonames_row(cols)
+                    continue
+                name = cols[0].strip()
+                kind = cols[1].strip() if len(cols) > 1 else "city"
+                aliases = cols[2].split("|") if len(cols) > 2 and cols[2] else []
+                self.add_place(name, kind, aliases)
+
+    def _add_geonames_row(self, cols: List[str]):
+        # geonameid, name, asciiname, alternatenames, lat, lon, feature class,
+        # feature code, country code, ..., population (columna 14)
+        try:
+            population = int(cols[14] or 0)
+        except ValueError:
+            population = 0
+        if population < GAZETTEER_MIN_POPULATION:
+            return
+        # Solo alias en alfabeto latino (el resto no aparece en mensajes en español)
+        aliases = [
+            alias
+            for alias in cols[3].split(",")
+            if alias and all(ord(ch) < 0x250 for ch in alias)
+        ]
+        self.add_place(cols[1], "city", [cols[2]] + aliases)
+
+    def add_styles(self, styles: Dict[str, List[str]]):
+        for style, aliases in styles.items():
+            for alias in aliases:
+                self.add(alias, ("style", style, "style"))
+                self._excluded_words.update(tokenize(alias))
+
+    # -- búsqueda ------------------------------------------------------
+
+    def _matches(self, tokens: List[str]) -> List[Tuple[int, int, Tuple[str, str, str]]]:
+        """Coincidencias (inicio, fin, payload), la más larga en cada posición, sin solapes."""
+        matches = []
+        i = 0
+        n = len(tokens)
+        while i < n:
+            node = self._trie.get(tokens[i])
+            best = None
+            j = i
+            while node is not None:
+                j += 1
+                if _END in node:
+                    best = (i, j, node[_END])
+                if j >= n:
+                    break
+                node = node.get(tokens[j])
+            if best:
+                matches.append(best)
+                i = best[1]
+            else:
+                i += 1
+        return matches
+
+    def _intent_matches(
+        self, text: str
+    ) -> Tuple[List[str], List[Tuple[int, int, Tuple[str, str, str]]]]:
+        """
+        Tokens del mensaje y coincidencias válidas. Un topónimo ambiguo
+        (AMBIGUOUS_WORDS) se descarta salvo que vaya en mayúscula o detrás
+        de "a"/"en"/"por"; un estilo negado ("sin museos") también.
+        """
+        tokens = tokenize(text)
+        cased = _CASED_TOKEN_RE.findall(_strip_accents(text))
+        if len(cased) != len(tokens):
+            cased = tokens
+
+        matches = []
+        for start, end, payload in self._matches(tokens):
+            if (
+                payload[0] == "destination"
+                and end - start == 1
+                and tokens[start] in AMBIGUOUS_WORDS
+                and not cased[start][0].isupper()
+                and not (start and tokens[start - 1] in PLACE_PREPOSITIONS)
+            ):
+                continue
+            if payload[0] == "style" and self._negated(tokens, start):
+                continue
+            matches.append((start, end, payload))
+        return tokens, matches
+
+    @staticmethod
+    def _negated(tokens: List[str], start: int) -> bool:
+        i = start - 1
+        while i >= 0 and tokens[i] in FILLER_WORDS:
+            i -= 1
+        return i >= 0 and tokens[i] in NEGATION_WORDS
+
+    @staticmethod
+    def _duration(norm: str) -> str:
+        for pattern, unit in _DURATION_PATTERNS:
+            m = pattern.search(norm)
+            if not m:
+                continue
+            if unit == "weekend":
+                days = 2 if m.group(0) != "puente" else 3
+            else:
+                raw = m.group(1)
+                value = int(raw) if raw.isdigit() else NUMBER_WORDS[raw]
+                days = {"days": value, "nights": value + 1, "weeks": value * 7}[unit]
+            if 0 < days <= 60:
+                return f"{days} días"
+        return ""
+
+    def residual_terms(self, text: str) -> List[str]:
+        """
+        Palabras del mensaje que no son destino, duración, estilo ni relleno.
+        Si hay alguna, el usuario ha pedido algo concreto (con perro, sin
+        museos, en silla de ruedas...).
+        """
+        tokens, matches = self._intent_matches(text)
+        used = set()
+        for start, end, _ in matches:
+            used.update(range(start, end))
+        return [
+            token
+            for i, token in enumerate(tokens)
+            if i not in used
+            and token not in FILLER_WORDS
+            and token not in NUMBER_WORDS
+            and not token.isdigit()
+            and not re.fullmatch(r"\d+d", token)
+        ]
+
+    def extract(self, text: str) -> Dict[str, str]:
+        out = {"destination": "", "duration": "", "style": ""}
+        if not text:
+            return out
+
+        norm = normalize(text)
+        tokens, matches = self._intent_matches(text)
+
+        best_place: Optional[Tuple[int, int, int]] = None
+        for start, _, (kind, value, subtype) in matches:
+            if kind == "style":
+                if not out["style"]:
+                    out["style"] = value
+                continue
+            # Tipo (ciudad > región > país), luego el que sigue a "a"/"en", luego el primero
+            targeted = start > 0 and tokens[start - 1] in TARGET_PREPOSITIONS
+            rank = (KIND_PRIORITY.get(subtype, 3), 0 if targeted else 1, start)
+            if best_place is None or rank < best_place:
+                best_place = rank
+                out["destination"] = value
+
+        out["duration"] = self._duration(norm)
+
+        if not out["destination"]:
+            m = _TRAVEL_TO.search(text.lower())
+            if m and normalize(m.group(1)) not in self._excluded_words:
+                out["destination"] = m.group(1).title()
+
+        return out
+
+
+_extractor: Optional[IntentExtractor] = None
+
+
+def get_extractor() -> IntentExtractor:
+    """Extractor compartido; el gazetteer se compila una vez, en el primer uso."""
+    global _extractor
+    if _extractor is None:
+        extractor = IntentExtractor()
+        extractor.load_tsv(DEFAULT_GAZETTEER)
+        if GAZETTEER_PATH:
+            extractor.load_tsv(Path(GAZETTEER_PATH))
+        extractor.add_styles(STYLE_ALIASES)
+        print(f"🗺️ Gazetteer cargado: {extractor.places} destinos")
+        _extractor = extractor
+    return _extractor
+
+
+def extract_intent(text: str) -> Dict[str, str]:
+    """Devuelve {"destination", "duration", "style"} detectados en el mensaje."""
+    return get_extractor().extract(text)
+
+
+def has_custom_constraints(text: str) -> bool:
+    """True si el mensaje pide algo más que destino, duración y estilo."""
+    return bool(get_extractor().residual_terms(text))
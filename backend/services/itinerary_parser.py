@@ -0,0 +1,197 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from models.schemas import Itinerary
+
+_CLOSERS = {"{": "}", "[": "]"}
+_WS = " \t\r\n"
+
+
+_VALUE_STARTS = set('"{[]}-0123456789tfn')
+
+
+def _next_significant(text: str, start: int) -> Tuple[str, int, bool]:
+    """
+    Siguiente carácter no blanco a partir de `start`, su posición y si hay
+    un salto de línea antes.
+    """
+    newline = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if ch not in _WS:
+            return ch, i, newline
+        if ch == "\n":
+            newline = True
+    return "", len(text), newline
+
+
+def _closes_string(text: str, quote_pos: int) -> bool:
+    """¿La comilla en `quote_pos` cierra la cadena o es una comilla interna sin escapar?"""
+    nxt, pos, newline = _next_significant(text, quote_pos + 1)
+    if nxt in ("}", "]", ""):
+        return True
+    if nxt in (",", ":"):
+        # Detrás de , o : tiene que empezar algo que parezca JSON
+        after, _, _ = _next_significant(text, pos + 1)
+        return after == "" or after in _VALUE_STARTS
+    # Coma olvidada: "valor"\n  "clave": ...
+    return nxt == '"' and newline
+
+
+def repair_json(text: str) -> Optional[str]:
+    """
+    Repara en una sola pasada los fallos típicos del JSON que escriben los LLM:
+
+    - texto antes/después del objeto y vallas ``` de markdown,
+    - comas finales antes de } o ],
+    - comas olvidadas entre valores separados por salto de línea,
+    - comillas sin escapar y saltos de línea literales dentro de cadenas,
+    - respuesta truncada: se corta en el último punto completo y se cierran
+      las cadenas, listas y objetos abiertos.
+
+    Devuelve el texto reparado o None si no hay ningún objeto/lista.
+    """
+    start = -1
+    for i, ch in enumerate(text):
+        if ch in "{[":
+            start = i
+            break
+    if start == -1:
+        return None
+
+    out: List[str] = []
+    stack: List[str] = []
+    # Puntos donde todo lo anterior es JSON completo: (longitud de out, pila)
+    safe_points: List[Tuple[int, Tuple[str, ...]]] = []
+    last_sig = ""  # último carácter significativo emitido fuera de cadenas
+    in_string = False
+    string_is_key = False
+    i = start
+    n = len(text)
+
+    while i < n:
+        ch = text[i]
+
+        if in_string:
+            if ch == "\\" and i + 1 < n:
+                out.append(ch)
+                out.append(text[i + 1])
+                i += 2
+                continue
+            if ch == '"':
+                if _closes_string(text, i):
+                    out.append('"')
+                    in_string = False
+                    last_sig = '"'
+                    if not string_is_key:
+                        safe_points.append((len(out), tuple(stack)))
+                else:
+                    # Comilla dentro del texto sin escapar
+                    out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            elif ch == "\t":
+                out.append("\\t")
+            elif ch == "\r":
+                pass
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch == '"' or ch in "{[":
+            # Coma olvidada entre dos valores: "a": "b" "c": ... / } {
+            if last_sig in ("}", "]") or (last_sig == '"' and not string_is_key):
+                out.append(",")
+                last_sig = ","
+            if ch == '"':
+                in_string = True
+                string_is_key = bool(stack) and stack[-1] == "{" and last_sig in ("{", ",")
+                out.append(ch)
+            else:
+                stack.append(ch)
+                out.append(ch)
+                last_sig = ch
+                safe_points.append((len(out), tuple(stack)))
+        elif ch in "}]":
+            # Comas finales: {"a": 1,} -> {"a": 1}
+            while out and out[-1] in _WS:
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if not stack:
+                break
+            out.append(_CLOSERS[stack.pop()])
+            last_sig = out[-1]
+            safe_points.append((len(out), tuple(stack)))
+            if not stack:
+                return "".join(out)
+        elif ch == ",":
+            if last_sig not in ("{", "[", ","):
+                safe_points.append((len(out), tuple(stack)))
+                out.append(ch)
+                last_sig = ch
+        else:
+            out.append(ch)
+            if ch not in _WS:
+                last_sig = ch
+        i += 1
+
+    # Respuesta truncada
+    if in_string and not string_is_key:
+        out.append('"')
+        safe_points.append((len(out), tuple(stack)))
+    if not safe_points:
+        return None
+    cut, open_stack = safe_points[-1]
+    repaired = "".join(out[:cut]).rstrip().rstrip(",")
+    return repaired + "".join(_CLOSERS[c] for c in reversed(open_stack))
+
+
+def extract_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Obtiene el objeto JSON de una respuesta del modelo. Prueba primero
+    `json.loads` (caso normal, el más rápido), luego el tramo entre la primera
+    { y la última } (texto alrededor) y si aún falla, repara el texto.
+    """
+    cleaned = text.replace("```json", "").replace("```", "").strip()
+    try:
+        obj = json.loads(cleaned)
+    except ValueError:
+        obj = None
+
+    if obj is None:
+        start, end = cleaned.find("{"), cleaned.rfind("}")
+        if start != -1 and end > start:
+            try:
+                obj = json.loads(cleaned[start : end + 1])
+            except ValueError:
+                obj = None
+
+    if obj is None:
+        repaired = repair_json(cleaned)
+        if repaired is None:
+            return None
+        try:
+            obj = json.loads(repaired)
+        except ValueError as e:
+            print(f"⚠️ Error parseando JSON de itinerario: {e}")
+            return None
+    return obj if isinstance(obj, dict) else None
+
+
+def validate_itinerary(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Valida/normaliza un itinerario con el esquema. None si no lo es."""
+    try:
+        return Itinerary.model_validate(obj).model_dump(mode="json")
+    except ValidationError as e:
+        print(f"⚠️ JSON recibido no es un itinerario válido: {e.error_count()} errores")
+        return None
+
+
+def parse_itinerary(text: str) -> Optional[Dict[str, Any]]:
+    """Texto del modelo -> itinerario validado (o None)."""
+    obj = extract_json_object(text)
+    return validate_itinerary(obj) if obj is not None else None
@@ -0,0 +1,147 @@
+import copy
+import re
+from typing import Any, Dict, List
+
+from pydantic import BaseModel, ValidationError
+
+from models.schemas import ITEM_ALIASES, Itinerary, ItineraryDay, ItineraryItem
+
+# Operaciones soportadas (subconjunto de JSON Patch, RFC 6902)
+PATCH_OPS = ("add", "remove", "replace")
+
+# Rutas permitidas: "/titulo", "/dias/0", "/dias/-", "/dias/0/tip_pro",
+# "/dias/0/itinerario/2", "/dias/0/itinerario/-", "/dias/0/itinerario/2/hora"...
+_PATH_RE = re.compile(
+    r"^/(?:(?P<trip_field>titulo|resumen)"
+    r"|dias/(?P<day>\d+|-)"
+    r"(?:/(?P<day_field>titulo_dia|resumen|tip_pro)"
+    r"|/itinerario/(?P<item>\d+|-)(?:/(?P<item_field>\w+))?)?)$"
+)
+
+
+class PatchError(ValueError):
+    """El patch no es válido para el itinerario actual."""
+
+
+def _validate(model: type[BaseModel], value: Any, what: str) -> Dict[str, Any]:
+    """Valida/normaliza con el mismo esquema que el itinerario completo."""
+    try:
+        return model.model_validate(value).model_dump(mode="json")
+    except ValidationError as e:
+        error = e.errors()[0]
+        where = ".".join(str(part) for part in error["loc"])
+        field = f" ({where})" if where else ""
+        raise PatchError(f"{what} no válido{field}: {error['msg']}") from None
+
+
+def _check_item(value: Any) -> Dict[str, Any]:
+    item = _validate(ItineraryItem, value, "Actividad")
+    if not item["activity"].strip():
+        raise PatchError("Una actividad necesita 'activity'")
+    return item
+
+
+def _check_day(value: Any) -> Dict[str, Any]:
+    day = _validate(ItineraryDay, value, "Día")
+    for item in day["itinerario"]:
+        if not item["activity"].strip():
+            raise PatchError("Una actividad necesita 'activity'")
+    return day
+
+
+def _index(raw: str, items: list, op: str) -> int:
+    """Convierte el segmento de ruta en índice, validando el rango según la operación."""
+    if raw == "-":
+        if op != "add":
+            raise PatchError("'-' solo se admite con 'add'")
+        return len(items)
+    idx = int(raw)
+    limit = len(items) if op == "add" else len(items) - 1
+    if idx > limit:
+        raise PatchError(f"Índice {idx} fuera de rango (máx. {limit})")
+    return idx
+
+
+def _apply_op(itinerary: Dict[str, Any], op: Dict[str, Any]):
+    if not isinstance(op, dict):
+        raise PatchError("Cada operación debe ser un objeto JSON")
+    kind = op.get("op")
+    path = op.get("path", "")
+    if kind not in PATCH_OPS:
+        raise PatchError(f"Operación no soportada: {kind!r}")
+    match = _PATH_RE.match(str(path))
+    if not match:
+        raise PatchError(f"Ruta no permitida: {path!r}")
+    if kind != "remove" and "value" not in op:
+        raise PatchError(f"'{kind}' necesita 'value' ({path})")
+    value = op.get("value")
+    parts = match.groupdict()
+
+    if parts["trip_field"]:
+        if kind != "replace":
+            raise PatchError(f"Solo 'replace' sobre {path}")
+        # Se valida con el resto del itinerario al final de apply_patch
+        itinerary[parts["trip_field"]] = value
+        return
+
+    days = itinerary.setdefault("dias", [])
+    day_idx = parts["day"]
+
+    # Operaciones sobre un día completo
+    if parts["day_field"] is None and parts["item"] is None:
+        idx = _index(day_idx, days, kind)
+        if kind == "remove":
+            days.pop(idx)
+        elif kind == "add":
+            days.insert(idx, _check_day(value))
+        else:
+            days[idx] = _check_day(value)
+        return
+
+    day_pos = _index(day_idx, days, "replace")
+    day = days[day_pos]
+
+    if parts["day_field"]:
+        if kind != "replace":
+            raise PatchError(f"Solo 'replace' sobre {path}")
+        days[day_pos] = _check_day({**day, parts["day_field"]: value})
+        return
+
+    items = day.setdefault("itinerario", [])
+
+    # Campo concreto de una actividad
+    if parts["item_field"]:
+        if kind != "replace":
+            raise PatchError(f"Solo 'replace' sobre campos de actividad ({path})")
+        field = ITEM_ALIASES.get(parts["item_field"], parts["item_field"])
+        idx = _index(parts["item"], items, "replace")
+        items[idx] = _check_item({**items[idx], field: value})
+        return
+
+    # Actividad completa
+    idx = _index(parts["item"], items, kind)
+    if kind == "remove":
+        items.pop(idx)
+    elif kind == "add":
+        items.insert(idx, _check_item(value))
+    else:
+        items[idx] = _check_item(value)
+
+
+def apply_patch(itinerary: Dict[str, Any], ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Aplica las operaciones en orden sobre una copia del itinerario y la devuelve.
+    Los índices de cada operación se refieren al estado que dejan las anteriores.
+    Si alguna operación no es válida se lanza PatchError y no se modifica nada.
+    """
+    if not isinstance(ops, list) or not ops:
+        raise PatchError("El patch debe ser una lista de operaciones no vacía")
+
+    patched = copy.deepcopy(itinerary)
+    for op in ops:
+        _apply_op(patched, op)
+
+    if not patched.get("dias"):
+        raise PatchError("El itinerario no puede quedarse sin días")
+    # El esquema renumera los días tras añadir/quitar
+    return _validate(Itinerary, patched, "Itinerario")
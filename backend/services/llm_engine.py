@@ -1,10 +1,12 @@
 import os
 from langchain_groq import ChatGroq
-from langchain_ollama import OllamaLLM
 from dotenv import load_dotenv
 
+# Antes de importar ollama_manager: lee OLLAMA_* del entorno al importarse
 load_dotenv()
 
+from services.ollama_manager import OLLAMA_CHAT_MODEL, ollama_manager
+
 
 def get_chat_model(model_name: str | None = None):
     """Devuelve una tupla (llm_instance, provider_name).
@@ -61,5 +63,5 @@ def get_chat_model(model_name: str | None = None):
 
 
 def _fallback_local():
-    base_url = os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
-    return OllamaLLM(model="llama3.2:3b", temperature=0.0, base_url=base_url)
+    # Cliente compartido: keep_alive y planificación por modelo del gestor
+    return ollama_manager.llm(OLLAMA_CHAT_MODEL, temperature=0.0)
@@ -4,6 +4,10 @@ from langchain_core.messages import HumanMessage, AIMessage
 # Estructura: { "user_1": { "history": [], "memory": {...} } }
 _store = {}
 
+def _empty_checkpoint() -> dict:
+    return {"accepted": [], "rejected": [], "notes": "", "summarized_messages": 0}
+
+
 def get_session_data(session_id: str):
     if session_id not in _store:
         _store[session_id] = {
@@ -11,6 +15,9 @@ def get_session_data(session_id: str):
             "memory": {"destination": "", "duration": "", "style": ""},
             "pending": {},
             "itinerary": None,
+            "itinerary_version": 0,
+            "doc_generation": 0,
+            "checkpoint": _empty_checkpoint(),
         }
     return _store[session_id]
 
@@ -18,6 +25,7 @@ def reset_session_history(session_id: str):
     """Borra el chat pero mantiene los datos de memoria si quisieras (aquí borramos chat)."""
     if session_id in _store:
         _store[session_id]["history"] = []
+        _store[session_id]["checkpoint"] = _empty_checkpoint()
 
 
 def get_pending(session_id: str):
@@ -38,12 +46,37 @@ def clear_pending(session_id: str):
 def set_itinerary(session_id: str, itinerary_obj: dict):
     data = get_session_data(session_id)
     data["itinerary"] = itinerary_obj
+    data["itinerary_version"] = data.get("itinerary_version", 0) + 1
+
+
+def itinerary_reference(session_id: str) -> str:
+    """
+    Texto corto que sustituye al JSON del itinerario en el historial: el
+    itinerario completo ya viaja en ITINERARIO_ACTUAL cuando hace falta.
+    """
+    data = get_session_data(session_id)
+    itinerary = data.get("itinerary") or {}
+    return (
+        f"[ITINERARIO v{data.get('itinerary_version', 0)}: "
+        f"\"{itinerary.get('titulo', '')}\", {len(itinerary.get('dias') or [])} días. "
+        "Versión vigente en ITINERARIO_ACTUAL]"
+    )
 
 
 def get_itinerary(session_id: str):
     data = get_session_data(session_id)
     return data.get("itinerary")
 
+def get_doc_generation(session_id: str) -> int:
+    """Versión de los documentos subidos en la sesión (cambia con cada subida)."""
+    return get_session_data(session_id).get("doc_generation", 0)
+
+
+def bump_doc_generation(session_id: str) -> int:
+    data = get_session_data(session_id)
+    data["doc_generation"] = data.get("doc_generation", 0) + 1
+    return data["doc_generation"]
+
 def update_trip_memory(session_id: str, dest=None, dur=None, style=None):
     """Actualiza los datos fijos del viaje (Ciudad, Días, Estilo)."""
     data = get_session_data(session_id)
@@ -63,6 +96,53 @@ def get_chat_history(session_id: str):
     """Devuelve la lista de mensajes de LangChain."""
     return get_session_data(session_id)["history"]
 
+
+def get_prompt_history(session_id: str):
+    """
+    Mensajes que se mandan al modelo junto al checkpoint: todos los que aún
+    no se han resumido. collapse_history quita del historial los resumidos,
+    así que si un resumen está en curso o falla no se pierde ningún turno.
+    """
+    return list(get_chat_history(session_id))
+
+
+def get_checkpoint(session_id: str) -> dict:
+    """Estado resumido de la conversación: preferencias aceptadas/rechazadas y notas."""
+    data = get_session_data(session_id)
+    return data.setdefault("checkpoint", _empty_checkpoint())
+
+
+def get_conversation_state(session_id: str) -> dict:
+    """Checkpoint + referencia al itinerario vigente (lo que ve el prompt)."""
+    data = get_session_data(session_id)
+    checkpoint = get_checkpoint(session_id)
+    state = {
+        "accepted": list(checkpoint["accepted"]),
+        "rejected": list(checkpoint["rejected"]),
+        "notes": checkpoint["notes"],
+        "itinerary": None,
+    }
+    if data.get("itinerary"):
+        state["itinerary"] = itinerary_reference(session_id)
+    return state
+
+
+def collapse_history(session_id: str, history_ref: list, count: int, checkpoint: dict) -> bool:
+    """
+    Sustituye los `count` mensajes más antiguos por el checkpoint ya resumido.
+    Solo si el historial sigue siendo el mismo (no se ha reiniciado mientras
+    se resumía); los mensajes nuevos siempre se añaden al final.
+    """
+    data = get_session_data(session_id)
+    if data["history"] is not history_ref or len(history_ref) < count:
+        return False
+    del history_ref[:count]
+    checkpoint["summarized_messages"] = (
+        get_checkpoint(session_id).get("summarized_messages", 0) + count
+    )
+    data["checkpoint"] = checkpoint
+    return True
+
 def get_trip_context(session_id: str):
     """Devuelve el diccionario con destino, duración y estilo."""
     return get_session_data(session_id)["memory"]
\ No newline at end of file
@@ -0,0 +1,331 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from langchain_ollama import OllamaEmbeddings, OllamaLLM
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
+OLLAMA_CHAT_MODEL = os.getenv("OLLAMA_CHAT_MODEL", "llama3.2:3b")
+OLLAMA_VISION_MODEL = os.getenv("OLLAMA_VISION_MODEL", "llava")
+
+# Tiempo que Ollama mantiene un modelo cargado tras usarlo ("30m", "2h", "600", "-1" = siempre)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Valores por modelo, p. ej. "llava=10m,llama3.2:3b=-1"
+OLLAMA_KEEP_ALIVE_MODELS = os.getenv("OLLAMA_KEEP_ALIVE_MODELS", "")
+# Cargar los modelos locales al arrancar el backend
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "1") != "0"
+
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "8"))
+OLLAMA_TIMEOUT_S = float(os.getenv("OLLAMA_TIMEOUT_S", "120"))
+# Peticiones seguidas a un modelo antes de ceder el turno a otro que está esperando
+OLLAMA_SCHED_MAX_BATCH = int(os.getenv("OLLAMA_SCHED_MAX_BATCH", "8"))
+# Espera máxima por el turno (s); pasado ese tiempo la petición se ejecuta igualmente
+OLLAMA_SCHED_MAX_WAIT_S = float(os.getenv("OLLAMA_SCHED_MAX_WAIT_S", "60"))
+
+_DURATION_RE = re.compile(r"^(-?\d+(?:\.\d+)?)\s*([smh]?)$")
+
+
+def parse_keep_alive(value: Any) -> int:
+    """"30m" / "2h" / "600" / "-1" -> segundos (-1 = no descargar nunca)."""
+    m = _DURATION_RE.match(str(value).strip().lower())
+    if not m:
+        raise ValueError(f"keep_alive no válido: {value!r}")
+    number = float(m.group(1))
+    if number < 0:
+        return -1
+    return int(number * {"": 1, "s": 1, "m": 60, "h": 3600}[m.group(2)])
+
+
+def _parse_model_keep_alive(spec: str) -> Dict[str, int]:
+    out = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        # rsplit: los nombres de modelo llevan ":" pero nunca "="
+        model, value = item.rsplit("=", 1)
+        out[model.strip()] = parse_keep_alive(value)
+    return out
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class ModelScheduler:
+    """
+    Agrupa las peticiones a Ollama por modelo. En una máquina con una sola
+    GPU/CPU, alternar llama3.2 y llava obliga a descargar y cargar el modelo
+    en cada cambio; aquí las peticiones al modelo cargado pasan mientras las
+    de otro modelo esperan a que se vacíe, y el cambio se hace una sola vez
+    para todo el grupo en espera.
+
+    Para que un modelo no acapare el turno, tras OLLAMA_SCHED_MAX_BATCH
+    peticiones seguidas cede ante otro que esté esperando. Ninguna petición
+    espera más de OLLAMA_SCHED_MAX_WAIT_S.
+    """
+
+    def __init__(self, max_batch: int = OLLAMA_SCHED_MAX_BATCH, max_wait_s: float = OLLAMA_SCHED_MAX_WAIT_S):
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_s
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self.current: Optional[str] = None
+        self._active = 0
+        self._served = 0  # peticiones del modelo actual en este turno
+        self._waiting: Counter = Counter()
+        self.switches = 0
+        self.forced = 0
+
+    def _can_run(self, model: str) -> bool:
+        others = {m: n for m, n in self._waiting.items() if m != self.current and n}
+        if model == self.current:
+            return self._served < self.max_batch or not others
+        if self._active:
+            return False
+        if self._waiting[self.current] and self._served < self.max_batch:
+            return False
+        # Turno libre: pasa el modelo con más peticiones en espera
+        return self._waiting[model] >= max(others.values(), default=0)
+
+    def acquire(self, model: str):
+        if _on_event_loop():
+            # Esperar turno aquí congela el loop, incluido el stream que lo tiene
+            print(f"⚠️ Planificador Ollama: {model} espera turno en el event loop (usa asyncio.to_thread)")
+        deadline = time.monotonic() + self.max_wait_s
+        with self._cond:
+            self._waiting[model] += 1
+            try:
+                while not self._can_run(model):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.forced += 1
+                        break
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting[model] -= 1
+                if not self._waiting[model]:
+                    del self._waiting[model]
+            if model != self.current:
+                if self.current is not None:
+                    self.switches += 1
+                self.current = model
+                self._served = 0
+            self._active += 1
+            self._served += 1
+
+    def release(self, model: str):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def use(self, model: str):
+        # Reentrante por hilo (embed_query -> embed_documents)
+        depth = getattr(self._local, "depth", 0)
+        if depth:
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+        self.acquire(model)
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            self.release(model)
+
+    @asynccontextmanager
+    async def use_async(self, model: str):
+        task = asyncio.ensure_future(asyncio.to_thread(self.acquire, model))
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Si nos cancelan esperando turno, el turno se libera al concederse
+            task.add_done_callback(
+                lambda t: None if t.cancelled() or t.exception() else self.release(model)
+            )
+            raise
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "current_model": self.current,
+                "active": self._active,
+                "waiting": dict(self._waiting),
+                "model_switches": self.switches,
+                "forced_after_wait": self.forced,
+            }
+
+
+class ScheduledOllamaLLM(OllamaLLM):
+    """OllamaLLM cuyas llamadas pasan por el planificador de modelos."""
+
+    def _generate(self, *args, **kwargs):
+        with ollama_manager.scheduler.use(self.model):
+            return super()._generate(*args, **kwargs)
+
+    def _stream(self, *args, **kwargs):
+        with ollama_manager.scheduler.use(self.model):
+            yield from super()._stream(*args, **kwargs)
+
+    async def _agenerate(self, *args, **kwargs):
+        async with ollama_manager.scheduler.use_async(self.model):
+            return await super()._agenerate(*args, **kwargs)
+
+    async def _astream(self, *args, **kwargs):
+        async with ollama_manager.scheduler.use_async(self.model):
+            async for chunk in super()._astream(*args, **kwargs):
+                yield chunk
+
+
+class ScheduledOllamaEmbeddings(OllamaEmbeddings):
+    """OllamaEmbeddings cuyas llamadas pasan por el planificador de modelos."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with ollama_manager.scheduler.use(self.model):
+            return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with ollama_manager.scheduler.use(self.model):
+            return super().embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        async with ollama_manager.scheduler.use_async(self.model):
+            return await super().aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async with ollama_manager.scheduler.use_async(self.model):
+            return await super().aembed_query(text)
+
+
+class OllamaManager:
+    """
+    Punto único de acceso a los modelos locales de Ollama:
+
+    - una sesión HTTP con pool de conexiones para las llamadas directas a la API,
+    - clientes LangChain reutilizados (uno por modelo y configuración),
+    - keep_alive configurable por modelo, para que Ollama no los descargue
+      a los 5 minutos por defecto,
+    - precarga de modelos al arrancar y planificación por modelo.
+    """
+
+    def __init__(self, base_url: str = OLLAMA_BASE_URL):
+        self.base_url = base_url.rstrip("/")
+        self.scheduler = ModelScheduler()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=OLLAMA_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._default_keep_alive = parse_keep_alive(OLLAMA_KEEP_ALIVE)
+        self._keep_alive = _parse_model_keep_alive(OLLAMA_KEEP_ALIVE_MODELS)
+        self._clients: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    def keep_alive(self, model: str) -> int:
+        return self._keep_alive.get(model, self._default_keep_alive)
+
+    def llm(self, model: str, temperature: float | None = None) -> OllamaLLM:
+        key = ("llm", model, temperature)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = ScheduledOllamaLLM(
+                    model=model,
+                    temperature=temperature,
+                    base_url=self.base_url,
+                    keep_alive=self.keep_alive(model),
+                )
+            return self._clients[key]
+
+    def embeddings(self, model: str) -> OllamaEmbeddings:
+        key = ("embeddings", model, None)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = ScheduledOllamaEmbeddings(
+                    model=model,
+                    base_url=self.base_url,
+                    keep_alive=self.keep_alive(model),
+                )
+            return self._clients[key]
+
+    def generate(
+        self,
+        model: str,
+        prompt: str,
+        images: List[str] | None = None,
+        options: Dict[str, Any] | None = None,
+    ) -> str:
+        """POST /api/generate (sin streaming) por la sesión compartida."""
+        body: Dict[str, Any] = {
+            "model": model,
+            "prompt": prompt,
+            "stream": False,
+            "keep_alive": self.keep_alive(model),
+        }
+        if images:
+            body["images"] = images
+        if options:
+            body["options"] = options
+
+        with self.scheduler.use(model):
+            response = self.session.post(
+                f"{self.base_url}/api/generate", json=body, timeout=OLLAMA_TIMEOUT_S
+            )
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"Ollama respondió {response.status_code}: {response.text[:200]}"
+            )
+        return response.json().get("response", "").strip()
+
+    def preload(self, models: Dict[str, str]) -> Dict[str, bool]:
+        """
+        Carga los modelos en Ollama sin generar nada. `models` es
+        {modelo: "generate" | "embed"}; se cargan en orden, así que el último
+        es el que queda en memoria si no caben todos.
+        """
+        loaded = {}
+        for model, kind in models.items():
+            endpoint = "/api/embed" if kind == "embed" else "/api/generate"
+            started = time.perf_counter()
+            try:
+                response = self.session.post(
+                    f"{self.base_url}{endpoint}",
+                    json={"model": model, "keep_alive": self.keep_alive(model)},
+                    timeout=OLLAMA_TIMEOUT_S,
+                )
+                loaded[model] = response.status_code == 200
+            except requests.RequestException as e:
+                print(f"⚠️ Ollama no disponible para precargar {model}: {e}")
+                loaded[model] = False
+                continue
+            if loaded[model]:
+                print(f"🦙 Modelo precargado: {model} ({time.perf_counter() - started:.1f}s)")
+            else:
+                print(f"⚠️ No se pudo precargar {model}: {response.status_code} {response.text[:200]}")
+        return loaded
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.scheduler.stats(),
+            "keep_alive_s": {"default": self._default_keep_alive, **self._keep_alive},
+        }
+
+
+ollama_manager = OllamaManager()
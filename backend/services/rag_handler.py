@@ -1,88 +1,232 @@
 import os
-import shutil
+import time
+import asyncio
 import base64
+import io
 import json
-import requests
+import threading
+from collections import deque
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, List, Tuple
 from fastapi import UploadFile
 from PIL import Image
+import fitz  # PyMuPDF
 
 # LangChain imports
-from langchain_community.document_loaders import PyMuPDFLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
 from langchain_core.documents import Document
-from langchain_ollama import OllamaLLM
+from services.itinerary_prompt import CHARS_PER_TOKEN
 from services.llm_engine import get_chat_model
+from services.ollama_manager import OLLAMA_CHAT_MODEL, OLLAMA_VISION_MODEL, ollama_manager
+from services import memory
+from services.retrieval_cache import RetrievalCache
+from services.compact_embeddings import ProjectedEmbeddings
+from services.upload_ingest import (
+    IMAGE_EXTENSIONS,
+    TEXT_EXTENSIONS,
+    IngestedUpload,
+    UploadRejected,
+    ingest_upload,
+)
 
 # Directorios
-UPLOAD_DIR = Path("./temp_uploads")
 DB_DIR = Path("./chroma_db")
 
-UPLOAD_DIR.mkdir(exist_ok=True)
 DB_DIR.mkdir(exist_ok=True)
 
-# Configuración de Ollama
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
+# Análisis simultáneos en subidas por lotes (la visión local es la más pesada)
+RAG_VISION_CONCURRENCY = int(os.getenv("RAG_VISION_CONCURRENCY", "1"))
+RAG_TEXT_CONCURRENCY = int(os.getenv("RAG_TEXT_CONCURRENCY", "4"))
+
+# Fragmentación de los análisis antes de indexarlos
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 400
+
+# Recuperación: "similarity" | "mmr" | "similarity_score_threshold"
+RAG_SEARCH_TYPE = os.getenv("RAG_SEARCH_TYPE", "mmr")
+RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.3"))
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.5"))
+# Presupuesto de tokens para el bloque de contexto que va al prompt
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "600"))
+
+# Embeddings y configuración del índice HNSW de Chroma
+RAG_EMBED_MODEL = os.getenv("RAG_EMBED_MODEL", "llama3.2:3b")
+# Dimensión reducida de los vectores guardados (0 = la del modelo)
+RAG_EMBED_DIM = int(os.getenv("RAG_EMBED_DIM", "0"))
+RAG_EMBED_SEED = 42
+# "cosine" | "l2" | "ip"
+RAG_DISTANCE = os.getenv("RAG_DISTANCE", "l2")
+RAG_HNSW_M = int(os.getenv("RAG_HNSW_M", "16"))
+RAG_HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "100"))
+RAG_HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "100"))
+
+COLLECTION_METADATA = {
+    "hnsw:space": RAG_DISTANCE,
+    "hnsw:M": RAG_HNSW_M,
+    "hnsw:construction_ef": RAG_HNSW_EF_CONSTRUCTION,
+    "hnsw:search_ef": RAG_HNSW_EF_SEARCH,
+}
+
+# Ciclo de vida del vector store.
+# Los vectores reducidos no son compatibles con los completos: van en otra colección.
+COLLECTION_NAME = (
+    f"trip_documents_rp{RAG_EMBED_DIM}" if RAG_EMBED_DIM else "trip_documents"
+)
+# Horas sin actividad tras las que se borran los fragmentos de una sesión
+RAG_SESSION_TTL_HOURS = float(os.getenv("RAG_SESSION_TTL_HOURS", "72"))
+# Cada cuántos minutos corre el mantenimiento en segundo plano (0 = nunca)
+RAG_GC_INTERVAL_MIN = float(os.getenv("RAG_GC_INTERVAL_MIN", "30"))
+# Se reconstruye el índice cuando la fracción de fragmentos borrados supera este valor
+RAG_COMPACT_RATIO = float(os.getenv("RAG_COMPACT_RATIO", "0.3"))
+RAG_COMPACT_MIN_DELETED = int(os.getenv("RAG_COMPACT_MIN_DELETED", "200"))
+# Tamaño de lote para leer/escribir en Chroma
+CHROMA_BATCH_SIZE = 500
+
+
+# Clave de COLLECTION_METADATA -> clave en la configuración HNSW de Chroma 1.x
+_HNSW_CONFIG_KEYS = {
+    "hnsw:space": "space",
+    "hnsw:M": "max_neighbors",
+    "hnsw:construction_ef": "ef_construction",
+    "hnsw:search_ef": "ef_search",
+}
+
+
+def live_hnsw_settings(collection) -> Dict[str, Any]:
+    """
+    Configuración HNSW con la que se creó la colección, con las claves de
+    COLLECTION_METADATA. Chroma 1.x la guarda en su configuración (y deja
+    los metadatos vacíos); las versiones anteriores, en los metadatos.
+    """
+    config = getattr(collection, "configuration_json", None) or {}
+    hnsw = config.get("hnsw") or {}
+    live = {
+        key: hnsw[name] for key, name in _HNSW_CONFIG_KEYS.items() if name in hnsw
+    }
+    metadata = collection.metadata or {}
+    live.update({key: metadata[key] for key in _HNSW_CONFIG_KEYS if key in metadata})
+    return live
 
 
 class RAGHandler:
     def __init__(self):
         # Embeddings locales (coherentes con llm_engine)
-        self.embeddings = OllamaEmbeddings(
-            model="llama3.2:3b",
-            base_url=OLLAMA_BASE_URL,
-        )
+        self.embeddings = ollama_manager.embeddings(RAG_EMBED_MODEL)
+        if RAG_EMBED_DIM:
+            self.embeddings = ProjectedEmbeddings(
+                self.embeddings, RAG_EMBED_DIM, RAG_EMBED_SEED
+            )
 
         # Inicializamos ChromaDB para documentos de viaje
-        self.vector_store = Chroma(
-            collection_name="trip_documents",
+        self.vector_store = self._open_vector_store()
+        self._recover_compaction()
+
+        # Modelo de visión (no se usa directamente, pero mantenemos para compatibilidad)
+        self.vision_model = ollama_manager.llm(OLLAMA_VISION_MODEL)
+
+        # Caché de resultados de recuperación por sesión
+        self.retrieval_cache = RetrievalCache()
+
+        # Ciclo de vida: última actividad por sesión, borrados y latencias
+        self._index_lock = threading.RLock()
+        self._started_at = time.time()
+        self._last_seen: Dict[str, float] = {}
+        self._deleted_since_compaction = 0
+        self._last_gc: Dict[str, Any] = {}
+        self._query_latencies_ms: deque = deque(maxlen=500)
+
+        # Límites de concurrencia por tipo de análisis (subidas por lotes)
+        self._analysis_limits = {
+            "vision": asyncio.Semaphore(RAG_VISION_CONCURRENCY),
+            "text": asyncio.Semaphore(RAG_TEXT_CONCURRENCY),
+        }
+
+    def _open_vector_store(self) -> Chroma:
+        # Los parámetros HNSW solo se aplican al crear la colección;
+        # para cambiarlos en una colección existente hay que compactarla.
+        store = Chroma(
+            collection_name=COLLECTION_NAME,
             embedding_function=self.embeddings,
             persist_directory=str(DB_DIR),
+            collection_metadata=COLLECTION_METADATA,
         )
+        live = live_hnsw_settings(store._collection)
+        # Solo se comparan los valores que se conocen (si no, no hay aviso)
+        differs = {
+            key: live[key]
+            for key, value in COLLECTION_METADATA.items()
+            if key in live and live[key] != value
+        }
+        if differs:
+            # Colección creada con otra configuración: sigue así hasta compactarla
+            print(
+                f"⚠️ La colección {COLLECTION_NAME} usa {differs} en vez de "
+                f"la configuración actual {COLLECTION_METADATA}; se aplicará al compactar"
+            )
+        return store
 
-        # Modelo de visión (no se usa directamente, pero mantenemos para compatibilidad)
-        self.vision_model = OllamaLLM(model="llava", base_url=OLLAMA_BASE_URL)
+    def _recover_compaction(self):
+        """
+        Recupera una compactación interrumpida. Si la colección principal ha
+        quedado vacía y sobrevive la original (`_old`) o la copia (`_compact`),
+        esa vuelve a su sitio; si la principal tiene datos, las sobrantes se borran.
+        """
+        client = self.vector_store._client
+        names = {
+            getattr(c, "name", c) for c in client.list_collections()
+        }
+        leftovers = [
+            name
+            for name in (f"{COLLECTION_NAME}_old", f"{COLLECTION_NAME}_compact")
+            if name in names
+        ]
+        if not leftovers:
+            return
+
+        if self.vector_store._collection.count() == 0:
+            # La original tiene todos los fragmentos; la copia puede estar a medias
+            restore = leftovers[0]
+            client.delete_collection(COLLECTION_NAME)
+            client.get_collection(restore).modify(name=COLLECTION_NAME)
+            leftovers.remove(restore)
+            print(f"♻️ Compactación interrumpida: recuperada la colección {restore}")
+        for name in leftovers:
+            client.delete_collection(name)
+        self.vector_store = self._open_vector_store()
 
-    def _prepare_image_for_vision(self, file_path: str) -> str:
+    def _prepare_image_for_vision(self, upload: IngestedUpload) -> bytes:
         """
         Prepara la imagen para ser enviada al modelo de visión.
-        Redimensiona si es muy grande para optimizar procesamiento.
+        Redimensiona si es muy grande y la recomprime a JPEG, todo en memoria.
         """
         try:
-            img = Image.open(file_path)
-            max_size = 1024
-            if img.width > max_size or img.height > max_size:
-                img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-
-            optimized_path = (
-                str(file_path)
-                .replace(".jpg", "_opt.jpg")
-                .replace(".jpeg", "_opt.jpg")
-                .replace(".png", "_opt.jpg")
-                .replace(".webp", "_opt.jpg")
-            )
-            img.save(optimized_path, "JPEG", quality=85)
-            return optimized_path
+            with upload.open() as source:
+                img = Image.open(source)
+                max_size = 1024
+                if img.width > max_size or img.height > max_size:
+                    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+
+                if img.mode != "RGB":
+                    img = img.convert("RGB")
+
+                optimized = io.BytesIO()
+                img.save(optimized, "JPEG", quality=85)
+            return optimized.getvalue()
         except Exception as e:
             print(f"⚠️ Error optimizando imagen: {e}")
-            return file_path
+            return upload.read_bytes()
 
-    def _analyze_image_with_ollama(self, file_path: str, filename: str) -> str:
+    def _analyze_image_with_ollama(self, image_bytes: bytes, filename: str) -> str:
         """
         Analiza una imagen usando la API de Ollama (modelo llava).
-        Envía la imagen en base64 junto con un prompt especializado.
+        Envía la imagen en base64 junto con un prompt especializado, por la
+        sesión HTTP compartida del gestor de Ollama.
         """
         print(f"👁️ Analizando imagen con Ollama: {filename}...")
 
         try:
-            with open(file_path, "rb") as img_file:
-                image_data = base64.b64encode(img_file.read()).decode("utf-8")
+            image_data = base64.b64encode(image_bytes).decode("utf-8")
 
             prompt = (
                 "Analiza esta imagen como experto en turismo. "
@@ -93,26 +237,14 @@ class RAGHandler:
                 "Sé conciso y práctico. Responde en español."
             )
 
-            response = requests.post(
-                f"{OLLAMA_BASE_URL}/api/generate",
-                json={
-                    "model": "llava",
-                    "prompt": prompt,
-                    "images": [image_data],
-                    "stream": False,
-                    "temperature": 0.7,
-                },
-                timeout=120,
+            analysis = ollama_manager.generate(
+                OLLAMA_VISION_MODEL,
+                prompt,
+                images=[image_data],
+                options={"temperature": 0.7},
             )
-
-            if response.status_code == 200:
-                result = response.json()
-                analysis = result.get("response", "").strip()
-                print(f"✅ Análisis de imagen completado: {len(analysis)} caracteres")
-                return analysis
-
-            print(f"❌ Error Ollama (imagen): {response.status_code} {response.text}")
-            return f"Error analizando imagen: {response.status_code}"
+            print(f"✅ Análisis de imagen completado: {len(analysis)} caracteres")
+            return analysis
 
         except Exception as e:
             print(f"❌ Error en análisis de imagen: {e}")
@@ -177,7 +309,7 @@ class RAGHandler:
                 # Intentar fallback local a Ollama
                 try:
                     print("🔁 Intentando fallback a Ollama local...")
-                    llm = OllamaLLM(model="llama3.2:3b", base_url=OLLAMA_BASE_URL)
+                    llm = ollama_manager.llm(OLLAMA_CHAT_MODEL)
                     result = llm.invoke(prompt)
                     print(
                         f"✅ Fallback local completado: {len(str(result))} caracteres"
@@ -191,122 +323,133 @@ class RAGHandler:
             print(f"❌ Error analizando documento: {e}")
             return f"Error: {str(e)}"
 
-    def _extract_text_from_pdf(self, file_path: str) -> str:
+    def _extract_text_from_pdf(self, upload: IngestedUpload) -> str:
         """
         Extrae texto de un PDF y lo etiqueta por páginas.
+        Los PDF pequeños se leen directamente de memoria.
         """
         try:
-            loader = PyMuPDFLoader(str(file_path))
-            docs = loader.load()
+            if upload.path is not None:
+                pdf = fitz.open(str(upload.path))
+            else:
+                pdf = fitz.open(stream=upload.data, filetype="pdf")
 
             full_text = ""
-            for i, doc in enumerate(docs):
-                if doc.page_content.strip():
-                    full_text += f"[Página {i + 1}]\n{doc.page_content}\n\n"
+            with pdf:
+                for i, page in enumerate(pdf):
+                    page_text = page.get_text()
+                    if page_text.strip():
+                        full_text += f"[Página {i + 1}]\n{page_text}\n\n"
 
             return full_text if full_text else "PDF vacío o no procesable"
         except Exception as e:
             print(f"❌ Error extrayendo texto de PDF: {e}")
             return f"Error leyendo PDF: {str(e)}"
 
-    def _extract_text_from_document(self, file_path: str) -> str:
+    def _extract_text_from_document(self, upload: IngestedUpload) -> str:
         """
         Extrae texto de documentos planos (TXT, MD, JSON, CSV).
+        El UTF-8 ya se ha validado al recibir la subida.
         """
         try:
-            loader = TextLoader(str(file_path), encoding="utf-8")
-            docs = loader.load()
-            return docs[0].page_content if docs else "Documento vacío"
+            text = upload.read_bytes().decode("utf-8-sig")
+            return text if text.strip() else "Documento vacío"
         except Exception as e:
             print(f"❌ Error extrayendo texto de documento: {e}")
             return f"Error leyendo documento: {str(e)}"
 
-    async def process_file(
-        self, file: UploadFile, session_id: str, model_name: str | None = None
-    ) -> Dict[str, Any]:
-        """
-        Procesa un archivo (imagen o documento) y devuelve un análisis de alto nivel.
-        Además, indexa el contenido analizado en ChromaDB para futuras consultas RAG.
-        """
-        file_path = UPLOAD_DIR / file.filename
+    @staticmethod
+    def _file_kind(upload: IngestedUpload) -> str:
+        """"vision" para imágenes, "text" para el resto de formatos."""
+        return "vision" if upload.kind == "image" else "text"
 
-        print(f"📥 Guardando archivo: {file.filename}")
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    @staticmethod
+    def _rejected(filename: str, error: UploadRejected) -> Dict[str, Any]:
+        print(f"⛔ Subida rechazada: {error}")
+        return {
+            "ok": False,
+            "filename": filename,
+            "error": str(error),
+            "status_code": error.status_code,
+        }
 
+    def _analyze_upload(
+        self,
+        upload: IngestedUpload,
+        session_id: str,
+        model_name: str | None = None,
+    ) -> Tuple[Dict[str, Any], List[Document]]:
+        """
+        Analiza una subida ya validada por `ingest_upload` (bloqueante).
+        Devuelve el resultado para el cliente y los fragmentos a indexar,
+        sin escribir todavía en ChromaDB.
+        """
+        filename = upload.filename
         try:
-            ext = file.filename.split(".")[-1].lower()
+            ext = upload.ext
             analysis_text = ""
             file_type = "unknown"
             display_content = ""
 
             if ext == "pdf":
-                print(f"📄 Procesando PDF: {file.filename}")
+                print(f"📄 Procesando PDF: {filename}")
                 file_type = "PDF"
-                pdf_text = self._extract_text_from_pdf(str(file_path))
+                pdf_text = self._extract_text_from_pdf(upload)
                 analysis_text = self._analyze_document_with_llm(
-                    pdf_text, file.filename, "PDF", model_name
+                    pdf_text, filename, "PDF", model_name
                 )
                 display_content = analysis_text
 
-            elif ext in ["txt", "md", "json", "csv"]:
-                print(f"📝 Procesando documento de texto: {file.filename}")
+            elif ext in TEXT_EXTENSIONS:
+                print(f"📝 Procesando documento de texto: {filename}")
                 file_type = f"{ext.upper()} Document"
-                doc_text = self._extract_text_from_document(str(file_path))
+                doc_text = self._extract_text_from_document(upload)
                 analysis_text = self._analyze_document_with_llm(
-                    doc_text, file.filename, file_type, model_name
+                    doc_text, filename, file_type, model_name
                 )
                 display_content = analysis_text
 
-            elif ext in ["jpg", "jpeg", "png", "webp"]:
-                print(f"🖼️ Procesando imagen: {file.filename}")
+            elif ext in IMAGE_EXTENSIONS:
+                print(f"🖼️ Procesando imagen: {filename}")
                 file_type = "Image"
-                optimized_path = self._prepare_image_for_vision(str(file_path))
-                analysis_text = self._analyze_image_with_ollama(
-                    optimized_path, file.filename
-                )
+                image_bytes = self._prepare_image_for_vision(upload)
+                analysis_text = self._analyze_image_with_ollama(image_bytes, filename)
                 display_content = analysis_text
 
-                try:
-                    if optimized_path != str(file_path):
-                        os.remove(optimized_path)
-                except Exception:
-                    pass
-
             else:
                 return {
                     "ok": False,
+                    "filename": filename,
                     "error": f"Formato .{ext} no soportado. Usa: PDF, TXT, MD, JSON, CSV, JPG, PNG, WEBP",
-                }
+                }, []
 
             if not analysis_text or len(analysis_text.strip()) < 10:
                 return {
                     "ok": False,
+                    "filename": filename,
                     "error": f"No se pudo analizar el contenido de {file_type}",
-                }
+                }, []
 
-            # 3. Indexar en ChromaDB para RAG
+            # 3. Fragmentos para indexar en ChromaDB (RAG)
             doc = Document(
                 page_content=analysis_text,
                 metadata={
-                    "source": file.filename,
+                    "source": filename,
                     "type": ext,
                     "file_type": file_type,
                     "session_id": session_id,
+                    "sha256": upload.sha256,
+                    "indexed_at": time.time(),
                 },
             )
 
             text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=2000,
-                chunk_overlap=400,
+                chunk_size=CHUNK_SIZE,
+                chunk_overlap=CHUNK_OVERLAP,
                 separators=["\n\n", "\n", ". ", " ", ""],
             )
             splits = text_splitter.split_documents([doc])
 
-            if splits:
-                self.vector_store.add_documents(documents=splits)
-                print(f"✅ {len(splits)} fragmentos indexados en ChromaDB")
-
             preview = (
                 display_content[:300] + "..."
                 if len(display_content) > 300
@@ -315,14 +458,15 @@ class RAGHandler:
 
             return {
                 "ok": True,
-                "filename": file.filename,
+                "filename": filename,
                 "file_type": file_type,
                 "analysis": display_content,
                 "preview": preview,
                 "status": "analizado_exitosamente",
+                **upload.describe(),
                 "ready_for_chat": True,
                 "message": f"✅ {file_type} analizado correctamente. Información lista para usar en el itinerario.",
-            }
+            }, splits
 
         except Exception as e:
             print(f"❌ Error procesando archivo: {e}")
@@ -331,41 +475,358 @@ class RAGHandler:
             traceback.print_exc()
             return {
                 "ok": False,
+                "filename": filename,
                 "error": f"Error: {str(e)}",
-            }
+            }, []
 
-        finally:
-            if file_path.exists():
+    def _index_splits(self, splits: List[Document], session_id: str) -> int:
+        """Indexa los fragmentos de la sesión en una sola llamada e invalida su caché."""
+        if splits:
+            with self._index_lock:
+                self.vector_store.add_documents(documents=splits)
+            print(f"✅ {len(splits)} fragmentos indexados en ChromaDB")
+        self._last_seen[session_id] = time.time()
+
+        # Los documentos de la sesión han cambiado: invalidamos su caché
+        memory.bump_doc_generation(session_id)
+        self.retrieval_cache.invalidate(session_id)
+        return len(splits)
+
+    async def process_file(
+        self, file: UploadFile, session_id: str, model_name: str | None = None
+    ) -> Dict[str, Any]:
+        """
+        Procesa un archivo (imagen o documento) y devuelve un análisis de alto nivel.
+        Además, indexa el contenido analizado en ChromaDB para futuras consultas RAG.
+        Todo el trabajo bloqueante va a hilos: las llamadas a Ollama esperan
+        turno en el planificador y no deben parar el event loop.
+        """
+        try:
+            upload = await asyncio.to_thread(ingest_upload, file)
+        except UploadRejected as e:
+            return self._rejected(file.filename, e)
+
+        with upload:
+            result, splits = await asyncio.to_thread(
+                self._analyze_upload, upload, session_id, model_name
+            )
+            if result.get("ok"):
+                await asyncio.to_thread(self._index_splits, splits, session_id)
+            return result
+
+    async def _analyze_limited(
+        self,
+        index: int,
+        upload: IngestedUpload,
+        session_id: str,
+        model_name: str | None,
+        handed_off: set,
+    ) -> Tuple[int, Dict[str, Any], List[Document]]:
+        """
+        Analiza un archivo del lote respetando el límite de su tipo. Desde que
+        entra en el hilo (queda en `handed_off`) es el hilo quien borra la
+        subida al terminar: cancelar la tarea no para el hilo, que seguiría
+        leyendo el archivo.
+        """
+        semaphore = self._analysis_limits[self._file_kind(upload)]
+        async with semaphore:
+            handed_off.add(index)
+            result, splits = await asyncio.to_thread(
+                self._analyze_and_cleanup,
+                upload,
+                session_id,
+                model_name,
+            )
+        return index, result, splits
+
+    def _analyze_and_cleanup(
+        self, upload: IngestedUpload, session_id: str, model_name: str | None
+    ) -> Tuple[Dict[str, Any], List[Document]]:
+        with upload:
+            return self._analyze_upload(upload, session_id, model_name)
+
+    async def save_uploads(
+        self, files: List[UploadFile]
+    ) -> List[IngestedUpload | Dict[str, Any]]:
+        """
+        Valida y recibe un lote de subidas (ver `ingest_upload`). Debe llamarse
+        dentro del endpoint: FastAPI cierra los UploadFile antes de que empiece
+        una respuesta en streaming. Las rechazadas se devuelven ya como
+        resultado de error.
+        """
+        saved = []
+        try:
+            for file in files:
                 try:
-                    os.remove(file_path)
-                    print("🗑️ Archivo temporal eliminado")
-                except Exception:
-                    pass
+                    saved.append(await asyncio.to_thread(ingest_upload, file))
+                except UploadRejected as e:
+                    saved.append(self._rejected(file.filename, e))
+        except BaseException:
+            for upload in saved:
+                if isinstance(upload, IngestedUpload):
+                    upload.cleanup()
+            raise
+        return saved
+
+    async def process_files(
+        self,
+        saved: List[IngestedUpload | Dict[str, Any]],
+        session_id: str,
+        model_name: str | None = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Analiza varios archivos (ya guardados con `save_uploads`) a la vez y va
+        devolviendo cada resultado en cuanto termina (evento "file"). Los análisis
+        de imagen y de texto tienen límites de concurrencia separados
+        (RAG_VISION_CONCURRENCY / RAG_TEXT_CONCURRENCY). Al final, todos los
+        fragmentos se indexan en una sola llamada a ChromaDB y se emite un
+        evento "done". Las subidas rechazadas se notifican al momento, sin
+        llegar a analizarse.
+        """
+        started = time.perf_counter()
+        # Subidas que ya están en un hilo de análisis (las limpia el hilo)
+        handed_off: set = set()
+        tasks = [
+            asyncio.create_task(
+                self._analyze_limited(
+                    index, upload, session_id, model_name, handed_off
+                )
+            )
+            for index, upload in enumerate(saved)
+            if isinstance(upload, IngestedUpload)
+        ]
+
+        all_splits: List[Document] = []
+        ok_count = 0
+        try:
+            for index, upload in enumerate(saved):
+                if not isinstance(upload, IngestedUpload):
+                    yield {"event": "file", "index": index, **upload}
+            for next_done in asyncio.as_completed(tasks):
+                index, result, splits = await next_done
+                if result.get("ok"):
+                    ok_count += 1
+                    all_splits.extend(splits)
+                yield {"event": "file", "index": index, **result}
+        finally:
+            # Si el cliente se desconecta, no seguimos esperando análisis pendientes.
+            # Solo se borran las subidas que no llegaron a su hilo; las demás
+            # las borra el hilo cuando termina.
+            for task in tasks:
+                task.cancel()
+            for index, upload in enumerate(saved):
+                if isinstance(upload, IngestedUpload) and index not in handed_off:
+                    upload.cleanup()
+
+        indexed = 0
+        if ok_count:
+            indexed = await asyncio.to_thread(
+                self._index_splits, all_splits, session_id
+            )
+
+        yield {
+            "event": "done",
+            "ok": ok_count > 0,
+            "files": len(saved),
+            "analyzed": ok_count,
+            "indexed_chunks": indexed,
+            "elapsed_s": round(time.perf_counter() - started, 2),
+        }
+
+    def _search(
+        self,
+        query: str,
+        session_id: str,
+        k: int,
+        search_type: str,
+        min_score: float,
+        embedding: List[float] | None = None,
+    ) -> List[Document]:
+        """
+        Ejecuta la búsqueda vectorial según la estrategia elegida.
+        Si ya tenemos el embedding de la consulta, se busca por vector.
+        """
+        session_filter = {"session_id": session_id}
+
+        if search_type == "mmr":
+            # MMR evita traer varios fragmentos casi idénticos (solapamiento de chunks)
+            if embedding is not None:
+                return self.vector_store.max_marginal_relevance_search_by_vector(
+                    embedding,
+                    k=k,
+                    fetch_k=k * 4,
+                    lambda_mult=RAG_MMR_LAMBDA,
+                    filter=session_filter,
+                )
+            return self.vector_store.max_marginal_relevance_search(
+                query,
+                k=k,
+                fetch_k=k * 4,
+                lambda_mult=RAG_MMR_LAMBDA,
+                filter=session_filter,
+            )
+
+        if search_type == "similarity_score_threshold":
+            if embedding is not None:
+                to_relevance = self.vector_store._select_relevance_score_fn()
+                scored = [
+                    (doc, to_relevance(distance))
+                    for doc, distance in self.vector_store.similarity_search_by_vector_with_relevance_scores(
+                        embedding, k=k, filter=session_filter
+                    )
+                ]
+            else:
+                scored = self.vector_store.similarity_search_with_relevance_scores(
+                    query, k=k, filter=session_filter
+                )
+            return [doc for doc, score in scored if score >= min_score]
+
+        if embedding is not None:
+            return self.vector_store.similarity_search_by_vector(
+                embedding, k=k, filter=session_filter
+            )
+        return self.vector_store.similarity_search(query, k=k, filter=session_filter)
+
+    @staticmethod
+    def _overlap_size(left: str, right: str) -> int:
+        """
+        Longitud del solapamiento entre el final de `left` y el inicio de `right`
+        (el que deja el text splitter entre fragmentos consecutivos).
+        """
+        max_len = min(len(left), len(right), CHUNK_OVERLAP)
+        for size in range(max_len, 20, -1):
+            if left.endswith(right[:size]):
+                return size
+        return 0
+
+    def _dedupe_snippets(self, docs: List[Document]) -> List[Tuple[Document, str]]:
+        """
+        Elimina fragmentos repetidos y recorta el texto solapado con fragmentos
+        ya seleccionados del mismo archivo.
+        """
+        seen = set()
+        by_source: Dict[str, List[str]] = {}
+        snippets: List[Tuple[Document, str]] = []
+
+        for doc in docs:
+            full = doc.page_content.strip()
+            key = " ".join(full.lower().split())
+            if not key or key in seen:
+                continue
+            seen.add(key)
+
+            source = str(doc.metadata.get("source", ""))
+            text = full
+            for previous in by_source.get(source, []):
+                if text in previous:
+                    text = ""
+                    break
+                # previous -> text: quitamos la cabeza repetida
+                text = text[self._overlap_size(previous, text) :]
+                # text -> previous: quitamos la cola repetida
+                tail = self._overlap_size(text, previous)
+                if tail:
+                    text = text[:-tail]
+
+            text = text.strip()
+            if len(text) < 20:
+                continue
+
+            by_source.setdefault(source, []).append(full)
+            snippets.append((doc, text))
+
+        return snippets
+
+    @staticmethod
+    def _pack_snippets(
+        snippets: List[Tuple[Document, str]], token_budget: int
+    ) -> List[Tuple[Document, str]]:
+        """
+        Mete los fragmentos (en orden de relevancia) dentro del presupuesto de tokens.
+        El último fragmento se corta en un límite de palabra si no cabe entero.
+        """
+        remaining = token_budget * CHARS_PER_TOKEN
+        packed: List[Tuple[Document, str]] = []
 
-    def retrieve_context(self, query: str, session_id: str, k: int = 5) -> str:
+        for doc, text in snippets:
+            # Cabecera "[i] tipo - archivo:" aproximada
+            remaining -= 40
+            if remaining <= 80:
+                break
+            if len(text) > remaining:
+                cut = text[:remaining].rsplit(" ", 1)[0]
+                packed.append((doc, cut + "..."))
+                break
+            packed.append((doc, text))
+            remaining -= len(text)
+
+        return packed
+
+    def retrieve_context(
+        self,
+        query: str,
+        session_id: str,
+        k: int = 5,
+        search_type: str | None = None,
+        min_score: float | None = None,
+        token_budget: int | None = None,
+    ) -> str:
         """
         Recupera contexto relevante de archivos previamente analizados,
-        filtrando por session_id y ordenando por similitud.
+        filtrando por session_id.
+
+        - `search_type`: "similarity", "mmr" o "similarity_score_threshold"
+          (por defecto RAG_SEARCH_TYPE).
+        - `min_score`: relevancia mínima (0-1) en modo "similarity_score_threshold".
+        - `token_budget`: tokens aproximados para todo el bloque de fragmentos.
         """
+        search_type = search_type or RAG_SEARCH_TYPE
+        min_score = RAG_MIN_SCORE if min_score is None else min_score
+        token_budget = token_budget or RAG_CONTEXT_TOKENS
+
+        self._last_seen[session_id] = time.time()
+        cache = self.retrieval_cache
+        generation = memory.get_doc_generation(session_id)
+        params = (k, search_type, min_score, token_budget)
+
+        cached = cache.get(session_id, generation, query, params)
+        if cached is not None:
+            return cached
+
         try:
-            results = self.vector_store.similarity_search(
-                query, k=k, filter={"session_id": session_id}
+            embedding = None
+            if cache.uses_embeddings:
+                embedding = self.embeddings.embed_query(query)
+                cached = cache.get_similar(session_id, generation, params, embedding)
+                if cached is not None:
+                    return cached
+            cache.record_miss()
+
+            started = time.perf_counter()
+            results = self._search(
+                query, session_id, k, search_type, min_score, embedding
+            )
+            self._query_latencies_ms.append((time.perf_counter() - started) * 1000)
+            snippets = self._pack_snippets(
+                self._dedupe_snippets(results), token_budget
             )
 
-            if not results:
+            if not snippets:
+                cache.put(session_id, generation, query, params, "", embedding)
                 return ""
 
             ctx = "\n\n📎 INFORMACIÓN DE ARCHIVOS ADJUNTOS:\n" + "=" * 60 + "\n"
 
-            for i, doc in enumerate(results, 1):
+            for i, (doc, text) in enumerate(snippets, 1):
                 file_type = str(doc.metadata.get("file_type", "unknown"))
                 filename = doc.metadata.get("source") or doc.metadata.get(
                     "filename", "desconocido"
                 )
                 ctx += f"\n[{i}] {file_type} - {filename}:\n"
-                ctx += f"{doc.page_content[:800]}\n"
+                ctx += f"{text}\n"
 
             ctx += "\n" + "=" * 60 + "\n"
+            cache.put(session_id, generation, query, params, ctx, embedding)
             return ctx
 
         except Exception as e:
@@ -373,4 +834,212 @@ class RAGHandler:
             return ""
 
 
+    # ------------------------------------------------------------------
+    # Ciclo de vida del vector store
+    # ------------------------------------------------------------------
+
+    def _iter_metadatas(self):
+        """Recorre (id, metadata) de toda la colección en lotes."""
+        collection = self.vector_store._collection
+        offset = 0
+        while True:
+            batch = collection.get(
+                include=["metadatas"], limit=CHROMA_BATCH_SIZE, offset=offset
+            )
+            ids = batch.get("ids") or []
+            if not ids:
+                return
+            for doc_id, meta in zip(ids, batch.get("metadatas") or []):
+                yield doc_id, meta or {}
+            offset += len(ids)
+
+    def _delete_ids(self, ids: List[str]) -> int:
+        with self._index_lock:
+            for start in range(0, len(ids), CHROMA_BATCH_SIZE):
+                self.vector_store.delete(ids=ids[start : start + CHROMA_BATCH_SIZE])
+            self._deleted_since_compaction += len(ids)
+        return len(ids)
+
+    def _forget_session(self, session_id: str):
+        # Solo la caché de recuperación: la sesión en memoria no se toca
+        # (ni se crea para ids que ya no existen)
+        self._last_seen.pop(session_id, None)
+        self.retrieval_cache.invalidate(session_id)
+
+    def delete_session(self, session_id: str) -> int:
+        """
+        Borra todos los fragmentos indexados de una sesión.
+        Devuelve el número de fragmentos eliminados.
+        """
+        result = self.vector_store.get(where={"session_id": session_id}, include=[])
+        deleted = self._delete_ids(result.get("ids") or [])
+        self._forget_session(session_id)
+        print(f"🗑️ Sesión {session_id}: {deleted} fragmentos eliminados")
+        return deleted
+
+    def collect_expired_sessions(
+        self, ttl_hours: float = RAG_SESSION_TTL_HOURS
+    ) -> Dict[str, int]:
+        """
+        Borra los fragmentos de las sesiones sin actividad en las últimas `ttl_hours`.
+        La actividad es la última subida/consulta vista en este proceso o, si no
+        la hay, la fecha de indexado más reciente (fragmentos antiguos sin fecha
+        cuentan desde el arranque del servidor). La actividad de las sesiones
+        sin fragmentos se descarta.
+        """
+        cutoff = time.time() - ttl_hours * 3600
+        ids_by_session: Dict[str, List[str]] = {}
+        last_activity: Dict[str, float] = {}
+
+        for doc_id, meta in self._iter_metadatas():
+            session_id = str(meta.get("session_id", ""))
+            ids_by_session.setdefault(session_id, []).append(doc_id)
+            indexed_at = float(meta.get("indexed_at") or self._started_at)
+            last_activity[session_id] = max(
+                last_activity.get(session_id, 0.0),
+                indexed_at,
+                self._last_seen.get(session_id, 0.0),
+            )
+
+        expired = {
+            session_id: self._delete_ids(ids_by_session[session_id])
+            for session_id, seen in last_activity.items()
+            if seen < cutoff
+        }
+        for session_id in expired:
+            self._forget_session(session_id)
+        # retrieve_context anota también sesiones sin fragmentos: sin esto,
+        # _last_seen crecería con cada id que haya consultado alguna vez
+        for session_id in list(self._last_seen):
+            if session_id not in ids_by_session:
+                self._last_seen.pop(session_id, None)
+
+        if expired:
+            print(
+                f"🧹 GC vector store: {len(expired)} sesiones caducadas, "
+                f"{sum(expired.values())} fragmentos eliminados"
+            )
+        return expired
+
+    def compact(self) -> int:
+        """
+        Reconstruye la colección copiando solo los fragmentos vivos.
+        Chroma no libera el espacio del índice HNSW al borrar, así que tras
+        muchos borrados el índice se rehace desde cero (con la configuración
+        HNSW actual, no con la que tenía la colección). La copia se pone en
+        su sitio antes de borrar la original, así que una caída a mitad se
+        recupera al arrancar (ver `_recover_compaction`).
+        Devuelve el número de fragmentos copiados.
+        """
+        with self._index_lock:
+            client = self.vector_store._client
+            old = self.vector_store._collection
+            tmp_name = f"{COLLECTION_NAME}_compact"
+            old_name = f"{COLLECTION_NAME}_old"
+
+            for leftover in (tmp_name, old_name):
+                try:
+                    client.delete_collection(leftover)
+                except Exception:
+                    pass
+            new = client.create_collection(tmp_name, metadata=COLLECTION_METADATA)
+
+            copied = 0
+            offset = 0
+            while True:
+                batch = old.get(
+                    include=["embeddings", "documents", "metadatas"],
+                    limit=CHROMA_BATCH_SIZE,
+                    offset=offset,
+                )
+                ids = batch.get("ids") or []
+                if not ids:
+                    break
+                new.add(
+                    ids=ids,
+                    embeddings=batch["embeddings"],
+                    documents=batch["documents"],
+                    metadatas=batch["metadatas"],
+                )
+                copied += len(ids)
+                offset += len(ids)
+
+            old.modify(name=old_name)
+            new.modify(name=COLLECTION_NAME)
+            client.delete_collection(old_name)
+            self.vector_store = self._open_vector_store()
+            self._deleted_since_compaction = 0
+
+        print(f"🗜️ Índice compactado: {copied} fragmentos")
+        return copied
+
+    def run_maintenance(self) -> Dict[str, Any]:
+        """GC por TTL y, si se ha borrado lo suficiente, compactación."""
+        expired = self.collect_expired_sessions()
+
+        compacted = None
+        live = self.vector_store._collection.count()
+        deleted = self._deleted_since_compaction
+        if deleted >= RAG_COMPACT_MIN_DELETED and deleted / max(
+            live + deleted, 1
+        ) >= RAG_COMPACT_RATIO:
+            compacted = self.compact()
+
+        self._last_gc = {
+            "at": time.time(),
+            "expired_sessions": len(expired),
+            "deleted_chunks": sum(expired.values()),
+            "compacted_chunks": compacted,
+        }
+        return self._last_gc
+
+    async def maintenance_loop(self):
+        """Tarea en segundo plano que lanza `run_maintenance` periódicamente."""
+        if RAG_GC_INTERVAL_MIN <= 0:
+            return
+        while True:
+            await asyncio.sleep(RAG_GC_INTERVAL_MIN * 60)
+            try:
+                await asyncio.to_thread(self.run_maintenance)
+            except Exception as e:
+                print(f"⚠️ Error en mantenimiento del vector store: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Tamaño de la colección, sesiones y latencia de consultas."""
+        sessions = set()
+        total = 0
+        for _, meta in self._iter_metadatas():
+            sessions.add(meta.get("session_id"))
+            total += 1
+
+        latencies = sorted(self._query_latencies_ms)
+        query_stats = {"count": len(latencies)}
+        if latencies:
+            query_stats.update(
+                {
+                    "avg_ms": round(sum(latencies) / len(latencies), 2),
+                    "p50_ms": round(latencies[len(latencies) // 2], 2),
+                    "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+                    "max_ms": round(latencies[-1], 2),
+                }
+            )
+
+        disk_bytes = sum(f.stat().st_size for f in DB_DIR.rglob("*") if f.is_file())
+
+        return {
+            "collection": COLLECTION_NAME,
+            "collection_metadata": self.vector_store._collection.metadata,
+            "embedding_model": RAG_EMBED_MODEL,
+            "embedding_dim": RAG_EMBED_DIM or "full",
+            "chunks": total,
+            "sessions": len(sessions),
+            "deleted_since_compaction": self._deleted_since_compaction,
+            "disk_bytes": disk_bytes,
+            "queries": query_stats,
+            "retrieval_cache": self.retrieval_cache.stats(),
+            "ollama": ollama_manager.stats(),
+            "last_maintenance": self._last_gc,
+        }
+
+
 rag_service = RAGHandler()
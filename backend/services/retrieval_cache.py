@@ -0,0 +1,172 @@
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Tamaño máximo de la caché (entradas totales y por sesión)
+RAG_CACHE_MAX_ENTRIES = int(os.getenv("RAG_CACHE_MAX_ENTRIES", "512"))
+RAG_CACHE_MAX_PER_SESSION = int(os.getenv("RAG_CACHE_MAX_PER_SESSION", "32"))
+# Similitud coseno mínima para reutilizar el resultado de una consulta parecida
+# (0 = desactivado, solo coincidencia exacta de la consulta normalizada)
+RAG_CACHE_SIM_THRESHOLD = float(os.getenv("RAG_CACHE_SIM_THRESHOLD", "0"))
+
+
+def normalize_query(query: str) -> str:
+    """Minúsculas, sin acentos, sin puntuación y con espacios colapsados."""
+    text = unicodedata.normalize("NFKD", query.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+class RetrievalCache:
+    """
+    Caché LRU de resultados de `retrieve_context` por sesión.
+
+    Cada entrada va versionada con la "generación" de documentos de la sesión:
+    cuando se sube un archivo la generación aumenta y las entradas antiguas
+    dejan de coincidir (y se purgan con `invalidate`).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RAG_CACHE_MAX_ENTRIES,
+        max_per_session: int = RAG_CACHE_MAX_PER_SESSION,
+        similarity_threshold: float = RAG_CACHE_SIM_THRESHOLD,
+    ):
+        self.max_entries = max_entries
+        self.max_per_session = max_per_session
+        self.similarity_threshold = similarity_threshold
+
+        self._lock = threading.Lock()
+        # clave -> (resultado, embedding normalizado o None)
+        self._entries: "OrderedDict[Tuple, Tuple[str, Optional[np.ndarray]]]" = (
+            OrderedDict()
+        )
+        self._per_session: Dict[str, int] = {}
+
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def uses_embeddings(self) -> bool:
+        return self.similarity_threshold > 0
+
+    @staticmethod
+    def _key(session_id: str, generation: int, query: str, params: Tuple) -> Tuple:
+        return (session_id, generation, normalize_query(query), params)
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def get(
+        self, session_id: str, generation: int, query: str, params: Tuple
+    ) -> Optional[str]:
+        """Busca por consulta normalizada exacta."""
+        key = self._key(session_id, generation, query, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_similar(
+        self,
+        session_id: str,
+        generation: int,
+        params: Tuple,
+        embedding: List[float],
+    ) -> Optional[str]:
+        """Busca una consulta cacheada cuyo embedding sea suficientemente parecido."""
+        if not self.uses_embeddings:
+            return None
+
+        query_vec = self._unit(embedding)
+        best_key, best_score = None, self.similarity_threshold
+        with self._lock:
+            for key, (_, vec) in self._entries.items():
+                if vec is None or key[0] != session_id:
+                    continue
+                if key[1] != generation or key[3] != params:
+                    continue
+                score = float(np.dot(query_vec, vec))
+                if score >= best_score:
+                    best_key, best_score = key, score
+
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self.similar_hits += 1
+            return self._entries[best_key][0]
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(
+        self,
+        session_id: str,
+        generation: int,
+        query: str,
+        params: Tuple,
+        value: str,
+        embedding: Optional[List[float]] = None,
+    ):
+        key = self._key(session_id, generation, query, params)
+        vec = self._unit(embedding) if embedding is not None else None
+        with self._lock:
+            if key not in self._entries:
+                self._per_session[session_id] = self._per_session.get(session_id, 0) + 1
+            self._entries[key] = (value, vec)
+            self._entries.move_to_end(key)
+            self._evict(session_id)
+
+    def _evict(self, session_id: str):
+        # Primero el límite por sesión (la entrada más antigua de esa sesión)
+        while self._per_session.get(session_id, 0) > self.max_per_session:
+            oldest = next(k for k in self._entries if k[0] == session_id)
+            self._drop(oldest)
+        # Después el límite global (la más antigua de todas)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: Tuple):
+        del self._entries[key]
+        self.evictions += 1
+        remaining = self._per_session.get(key[0], 1) - 1
+        if remaining > 0:
+            self._per_session[key[0]] = remaining
+        else:
+            self._per_session.pop(key[0], None)
+
+    def invalidate(self, session_id: str):
+        """Elimina todas las entradas de una sesión."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == session_id]:
+                del self._entries[key]
+            self._per_session.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "sessions": len(self._per_session),
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
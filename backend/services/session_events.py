@@ -0,0 +1,43 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, Dict, Set
+
+# Eventos pendientes por conexión antes de descartar los más antiguos
+SESSION_EVENTS_MAX_QUEUE = 100
+
+
+class SessionEvents:
+    """
+    Canal en memoria para avisar a las conexiones WebSocket de una sesión
+    (p. ej. cuando termina el análisis de un archivo subido por HTTP).
+    Solo debe usarse desde el event loop.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    def subscribe(self, session_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SESSION_EVENTS_MAX_QUEUE)
+        self._subscribers[session_id].add(queue)
+        return queue
+
+    def unsubscribe(self, session_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(session_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[session_id]
+
+    def publish(self, session_id: str, event: Dict[str, Any]) -> int:
+        """Entrega el evento a todas las conexiones de la sesión. Devuelve cuántas."""
+        subscribers = self._subscribers.get(session_id, ())
+        for queue in subscribers:
+            if queue.full():
+                # Cliente lento: se pierde el evento más antiguo, no el nuevo
+                queue.get_nowait()
+            queue.put_nowait(event)
+        return len(subscribers)
+
+
+session_events = SessionEvents()
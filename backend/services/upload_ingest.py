@@ -0,0 +1,201 @@
+import codecs
+import hashlib
+import io
+import os
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional
+
+from fastapi import UploadFile
+
+UPLOAD_DIR = Path("./temp_uploads")
+UPLOAD_DIR.mkdir(exist_ok=True)
+
+# Formatos soportados
+TEXT_EXTENSIONS = ["txt", "md", "json", "csv"]
+IMAGE_EXTENSIONS = ["jpg", "jpeg", "png", "webp"]
+
+# Tamaño máximo por tipo de archivo (MB)
+UPLOAD_MAX_MB = {
+    "pdf": float(os.getenv("UPLOAD_MAX_MB_PDF", "25")),
+    "image": float(os.getenv("UPLOAD_MAX_MB_IMAGE", "10")),
+    "text": float(os.getenv("UPLOAD_MAX_MB_TEXT", "2")),
+}
+# Hasta este tamaño la subida se queda en memoria; por encima va a un temporal en disco
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_KB", "1024")) * 1024
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+SUPPORTED_FORMATS = "PDF, TXT, MD, JSON, CSV, JPG, PNG, WEBP"
+
+
+class UploadRejected(ValueError):
+    """La subida no se procesa: formato no soportado o demasiado grande."""
+
+    def __init__(self, message: str, status_code: int = 415):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _extension(filename: str) -> str:
+    return filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+
+
+def _declared_kind(ext: str) -> Optional[str]:
+    if ext == "pdf":
+        return "pdf"
+    if ext in IMAGE_EXTENSIONS:
+        return "image"
+    if ext in TEXT_EXTENSIONS:
+        return "text"
+    return None
+
+
+def sniff_kind(head: bytes) -> Optional[str]:
+    """Tipo real del archivo a partir de sus primeros bytes ("pdf", "image", "text" o None)."""
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if (
+        head.startswith(b"\x89PNG\r\n\x1a\n")
+        or head.startswith(b"\xff\xd8\xff")
+        or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+    ):
+        return "image"
+    if b"\x00" in head:
+        return None
+    try:
+        # final=False: el bloque puede cortar un carácter multibyte al final
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+    except UnicodeDecodeError:
+        return None
+    return "text"
+
+
+class IngestedUpload:
+    """
+    Subida ya validada. Las pequeñas están en memoria (`data`); las grandes
+    en un temporal con nombre único (`path`). `cleanup()` (o usarla como
+    context manager) borra el temporal.
+    """
+
+    def __init__(self, filename: str, ext: str, kind: str):
+        self.filename = filename
+        self.ext = ext
+        self.kind = kind
+        self.size = 0
+        self.sha256 = ""
+        self.data: Optional[bytes] = None
+        self.path: Optional[Path] = None
+
+    def read_bytes(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        return self.path.read_bytes()
+
+    def open(self) -> BinaryIO:
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, "rb")
+
+    def cleanup(self):
+        self.data = None
+        if self.path is not None and self.path.exists():
+            try:
+                os.remove(self.path)
+                print("🗑️ Archivo temporal eliminado")
+            except Exception:
+                pass
+        self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+    def describe(self) -> Dict[str, object]:
+        return {"size_bytes": self.size, "sha256": self.sha256}
+
+
+def ingest_upload(file: UploadFile) -> IngestedUpload:
+    """
+    Lee la subida en bloques, valida y guarda en una sola pasada:
+
+    1. Extensión soportada y tamaño declarado dentro del límite del tipo.
+    2. Tipo real por los primeros bytes (magic bytes / UTF-8), que tiene que
+       cuadrar con la extensión.
+    3. Copia en streaming calculando el sha256; se corta en cuanto supera el
+       límite. Hasta UPLOAD_SPOOL_MAX_BYTES queda en memoria, por encima se
+       vuelca a un temporal con nombre único.
+
+    Lanza UploadRejected (sin dejar nada en disco) si algo no cuadra.
+    """
+    filename = Path(file.filename or "archivo").name
+    ext = _extension(filename)
+    kind = _declared_kind(ext)
+    if kind is None:
+        raise UploadRejected(f"Formato .{ext} no soportado. Usa: {SUPPORTED_FORMATS}")
+
+    max_bytes = int(UPLOAD_MAX_MB[kind] * 1024 * 1024)
+    too_large = UploadRejected(
+        f"{filename} supera el máximo de {UPLOAD_MAX_MB[kind]:g} MB para este tipo de archivo",
+        status_code=413,
+    )
+    declared_size = getattr(file, "size", None)
+    if declared_size is not None and declared_size > max_bytes:
+        raise too_large
+
+    source = file.file
+    head = source.read(UPLOAD_CHUNK_BYTES)
+    if not head:
+        raise UploadRejected(f"{filename} está vacío", status_code=400)
+    sniffed = sniff_kind(head)
+    if sniffed != kind:
+        raise UploadRejected(
+            f"El contenido de {filename} no corresponde a un archivo .{ext}"
+        )
+
+    upload = IngestedUpload(filename, ext, kind)
+    digest = hashlib.sha256()
+    # Los de texto se validan como UTF-8 completos mientras se copian
+    decoder = codecs.getincrementaldecoder("utf-8")() if kind == "text" else None
+    buffer = io.BytesIO()
+    out: BinaryIO = buffer
+    size = 0
+
+    try:
+        try:
+            chunk = head
+            while chunk:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise too_large
+                digest.update(chunk)
+                if decoder is not None:
+                    decoder.decode(chunk)
+                if out is buffer and size > UPLOAD_SPOOL_MAX_BYTES:
+                    upload.path = UPLOAD_DIR / f"{uuid.uuid4().hex}.{ext}"
+                    out = open(upload.path, "wb")
+                    out.write(buffer.getvalue())
+                    buffer = None
+                out.write(chunk)
+                chunk = source.read(UPLOAD_CHUNK_BYTES)
+            if decoder is not None:
+                decoder.decode(b"", final=True)
+        finally:
+            if out is not buffer:
+                out.close()
+    except UnicodeDecodeError:
+        upload.cleanup()
+        raise UploadRejected(f"{filename} no es texto UTF-8 válido") from None
+    except BaseException:
+        # Incluye UploadRejected por tamaño: no queda nada en disco
+        upload.cleanup()
+        raise
+
+    if upload.path is None:
+        upload.data = buffer.getvalue()
+    upload.size = size
+    upload.sha256 = digest.hexdigest()
+    where = "disco" if upload.path else "memoria"
+    print(f"📥 Subida aceptada: {filename} ({kind}, {size} bytes, {where}, sha256 {upload.sha256[:12]})")
+    return upload
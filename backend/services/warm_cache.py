@@ -0,0 +1,281 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.intent_extractor import normalize
+from services.itinerary_parser import parse_itinerary
+from services.itinerary_prompt import build_human_input, invoke_llm_with_usage
+from services.llm_engine import get_chat_model
+
+# Almacén SQLite de itinerarios pre-generados
+WARM_CACHE_PATH = Path(os.getenv("WARM_CACHE_PATH", "./warm_cache.sqlite3"))
+# Días tras los que un itinerario pre-generado deja de servirse y se regenera
+WARM_CACHE_MAX_AGE_DAYS = float(os.getenv("WARM_CACHE_MAX_AGE_DAYS", "14"))
+# Refresco en segundo plano (0 = solo a mano con tools/warm_itineraries.py)
+WARM_CACHE_REFRESH_HOURS = float(os.getenv("WARM_CACHE_REFRESH_HOURS", "0"))
+# Tokens máximos que puede gastar cada refresco
+WARM_CACHE_TOKEN_BUDGET = int(os.getenv("WARM_CACHE_TOKEN_BUDGET", "200000"))
+WARM_CACHE_MODEL = os.getenv("WARM_CACHE_MODEL", "smart")
+# Peticiones mínimas para que una combinación pedida entre en la cola de generación
+# (así una errata pedida una vez no pasa por delante de la lista por defecto)
+WARM_CACHE_MIN_REQUESTS = int(os.getenv("WARM_CACHE_MIN_REQUESTS", "3"))
+# Cada cuántos segundos se vuelcan a SQLite las peticiones contadas en memoria
+WARM_CACHE_DEMAND_FLUSH_SEC = float(os.getenv("WARM_CACHE_DEMAND_FLUSH_SEC", "60"))
+
+# Destinos más pedidos (los que ya reconocía parse_user_message)
+WARM_DESTINATIONS = [
+    "Madrid",
+    "Barcelona",
+    "Sevilla",
+    "Valencia",
+    "Granada",
+    "Bilbao",
+    "Málaga",
+    "Córdoba",
+    "Zaragoza",
+    "Santiago de Compostela",
+    "San Sebastián",
+    "Ibiza",
+    "Mallorca",
+    "Tenerife",
+]
+WARM_DAYS = range(1, 8)
+# "" = sin estilo indicado
+WARM_STYLES = ["", "cultural", "gastronómico", "relax"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS itineraries (
+    dest_key   TEXT    NOT NULL,
+    days       INTEGER NOT NULL,
+    style_key  TEXT    NOT NULL,
+    payload    BLOB    NOT NULL,   -- JSON del itinerario comprimido con zlib
+    model      TEXT    NOT NULL,
+    tokens     INTEGER NOT NULL,
+    created_at REAL    NOT NULL,
+    PRIMARY KEY (dest_key, days, style_key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS demand (
+    dest_key   TEXT    NOT NULL,
+    days       INTEGER NOT NULL,
+    style_key  TEXT    NOT NULL,
+    destination TEXT   NOT NULL,
+    style      TEXT    NOT NULL,
+    requests   INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dest_key, days, style_key)
+) WITHOUT ROWID;
+"""
+
+
+def _days(duration: str) -> Optional[int]:
+    m = re.search(r"\d+", str(duration or ""))
+    return int(m.group()) if m else None
+
+
+def _key(destination: str, duration: str, style: str) -> Optional[Tuple[str, int, str]]:
+    days = _days(duration)
+    if not destination or not days:
+        return None
+    return normalize(destination).strip(), days, normalize(style or "").strip()
+
+
+class WarmItineraryCache:
+    """
+    Itinerarios pre-generados para las combinaciones destino/días/estilo más
+    pedidas. La FASE 2 los sirve al instante cuando la sesión no tiene
+    archivos ni peticiones propias; un job por lotes los genera con el mismo
+    prompt que /generate y los renueva dentro de un presupuesto de tokens.
+    """
+
+    def __init__(self, path: Path = WARM_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        # Demanda pendiente de volcar: clave -> [destino, estilo, peticiones]
+        self._demand: Dict[Tuple[str, int, str], list] = {}
+        self._demand_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # -- servir --------------------------------------------------------
+
+    def lookup(self, destination: str, duration: str, style: str) -> Optional[Dict[str, Any]]:
+        """
+        Itinerario pre-generado y vigente para la combinación, o None.
+        La petición se cuenta en memoria; `flush_demand` la vuelca a SQLite
+        fuera del camino de la petición.
+        """
+        key = _key(destination, duration, style)
+        if key is None:
+            return None
+        min_created = time.time() - WARM_CACHE_MAX_AGE_DAYS * 86400
+
+        with self._demand_lock:
+            self._demand.setdefault(key, [destination, style or "", 0])[2] += 1
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM itineraries "
+                "WHERE dest_key = ? AND days = ? AND style_key = ? AND created_at >= ?",
+                (*key, min_created),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def store(self, destination: str, days: int, style: str, itinerary: Dict[str, Any], model: str, tokens: int):
+        key = _key(destination, str(days), style)
+        payload = zlib.compress(
+            json.dumps(itinerary, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            level=9,
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO itineraries "
+                "(dest_key, days, style_key, payload, model, tokens, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, payload, model, tokens, time.time()),
+            )
+            self._conn.commit()
+
+    def flush_demand(self) -> int:
+        """Vuelca a la tabla `demand` las peticiones contadas en memoria."""
+        with self._demand_lock:
+            pending, self._demand = self._demand, {}
+        if not pending:
+            return 0
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO demand (dest_key, days, style_key, destination, style, requests) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (dest_key, days, style_key) "
+                "DO UPDATE SET requests = requests + excluded.requests",
+                [(*key, *row) for key, row in pending.items()],
+            )
+            self._conn.commit()
+        return len(pending)
+
+    async def demand_flush_loop(self):
+        """Vuelca la demanda periódicamente (WARM_CACHE_DEMAND_FLUSH_SEC)."""
+        while True:
+            await asyncio.sleep(WARM_CACHE_DEMAND_FLUSH_SEC)
+            try:
+                await asyncio.to_thread(self.flush_demand)
+            except Exception as e:
+                print(f"⚠️ Error guardando demanda del warm cache: {e}")
+
+    # -- generar -------------------------------------------------------
+
+    def _pending_combinations(self) -> List[Tuple[str, int, str]]:
+        """
+        Combinaciones a (re)generar, de más a menos prioritaria: primero las
+        pedidas al menos WARM_CACHE_MIN_REQUESTS veces según la tabla
+        `demand`, luego la lista por defecto. Se saltan las que ya tienen un
+        itinerario vigente.
+        """
+        self.flush_demand()
+        refresh_before = time.time() - WARM_CACHE_MAX_AGE_DAYS * 86400 / 2
+        with self._lock:
+            fresh = {
+                row[:3]
+                for row in self._conn.execute(
+                    "SELECT dest_key, days, style_key, created_at FROM itineraries "
+                    "WHERE created_at >= ?",
+                    (refresh_before,),
+                )
+            }
+            popular = self._conn.execute(
+                "SELECT destination, days, style FROM demand "
+                "WHERE days BETWEEN 1 AND 14 AND requests >= ? ORDER BY requests DESC",
+                (WARM_CACHE_MIN_REQUESTS,),
+            ).fetchall()
+
+        defaults = [(d, n, s) for s in WARM_STYLES for n in WARM_DAYS for d in WARM_DESTINATIONS]
+        combos, seen = [], set()
+        for destination, days, style in popular + defaults:
+            key = _key(destination, str(days), style)
+            if key in seen or key in fresh:
+                continue
+            seen.add(key)
+            combos.append((destination, days, style))
+        return combos
+
+    def _generate(self, llm, destination: str, days: int, style: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        duration = f"{days} días"
+        message = f"Quiero un itinerario de {duration} en {destination}"
+        if style:
+            message += f", estilo {style}"
+        human_input = build_human_input(2, destination, duration, style, "", message)
+        text, tokens = invoke_llm_with_usage(llm, human_input, [])
+        return parse_itinerary(text), tokens
+
+    def refresh(self, token_budget: int = WARM_CACHE_TOKEN_BUDGET, model_name: str = WARM_CACHE_MODEL) -> Dict[str, Any]:
+        """
+        Genera itinerarios para las combinaciones pendientes hasta agotar
+        `token_budget`. Se para antes de una llamada si el coste medio de las
+        anteriores ya no cabe en lo que queda.
+        """
+        llm, provider = get_chat_model(model_name)
+        print(f"🔥 Warm cache: refresco con {provider}, presupuesto {token_budget} tokens")
+
+        spent, generated, failed = 0, 0, 0
+        for destination, days, style in self._pending_combinations():
+            calls = generated + failed
+            average = spent / calls if calls else 0
+            if spent + average > token_budget:
+                break
+            try:
+                itinerary, tokens = self._generate(llm, destination, days, style)
+            except Exception as e:
+                print(f"⚠️ Warm cache: error generando {destination}/{days}/{style}: {e}")
+                failed += 1
+                continue
+            spent += tokens
+            if itinerary is None:
+                failed += 1
+                continue
+            self.store(destination, days, style, itinerary, provider, tokens)
+            generated += 1
+
+        summary = {"generated": generated, "failed": failed, "tokens": spent}
+        print(f"🔥 Warm cache: {summary}")
+        return summary
+
+    async def refresh_loop(self):
+        """Refresco periódico en segundo plano (WARM_CACHE_REFRESH_HOURS)."""
+        if WARM_CACHE_REFRESH_HOURS <= 0:
+            return
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                print(f"⚠️ Error refrescando warm cache: {e}")
+            await asyncio.sleep(WARM_CACHE_REFRESH_HOURS * 3600)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, tokens = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM itineraries"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "generation_tokens": tokens,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "disk_bytes": self.path.stat().st_size if self.path.exists() else 0,
+        }
+
+
+warm_cache = WarmItineraryCache()
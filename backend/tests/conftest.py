@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Los módulos del backend se importan como en main.py ("services.*", "models.*")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
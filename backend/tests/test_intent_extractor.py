@@ -0,0 +1,43 @@
+import pytest
+
+from services.intent_extractor import extract_intent, has_custom_constraints
+
+
+@pytest.mark.parametrize(
+    "text, style",
+    [
+        ("3 días en Madrid sin museos", ""),
+        ("Sevilla sin niños", ""),
+        ("no quiero lujo en Roma", ""),
+        ("nada de tapas, 2 días en Bilbao", ""),
+        ("quita museos", ""),
+        ("elimina los museos", ""),
+        ("menos museos y más playa", ""),
+        ("quita las tapas", ""),
+        ("evita el lujo", ""),
+        ("Sevilla con niños", "familia"),
+        ("sin prisa, algo cultural en Roma", "cultural"),
+        ("sin límite de presupuesto en París", "high"),
+    ],
+)
+def test_negated_styles_are_ignored(text, style):
+    assert extract_intent(text)["style"] == style
+
+
+def test_negated_style_counts_as_custom_constraint():
+    assert has_custom_constraints("3 días en Madrid sin museos")
+    assert not has_custom_constraints("3 días en Madrid cultural")
+
+
+@pytest.mark.parametrize(
+    "text, destination",
+    [
+        ("¿qué tarifa tiene el hotel?", ""),
+        ("quiero una ronda de tapas en Madrid 3 días", "Madrid"),
+        ("3 días en tarifa", "Tarifa"),
+        ("Ronda 2 días", "Ronda"),
+        ("salgo de Sevilla y quiero ir a Granada", "Granada"),
+    ],
+)
+def test_ambiguous_place_names(text, destination):
+    assert extract_intent(text)["destination"] == destination
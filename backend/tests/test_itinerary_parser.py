@@ -0,0 +1,66 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from services.itinerary_parser import extract_json_object, parse_itinerary, repair_json
+
+CORPUS_DIR = Path(__file__).resolve().parent.parent / "benchmarks" / "itinerary_outputs"
+
+# archivo -> (claves del objeto extraído o None, actividades por día si es itinerario válido)
+EXPECTED = {
+    "01_clean.txt": ({"titulo", "resumen", "dias"}, [4, 4, 4]),
+    "02_fenced_with_prose.txt": ({"titulo", "resumen", "dias"}, [4, 4, 4]),
+    "03_trailing_commas.txt": ({"titulo", "resumen", "dias"}, [4, 4, 4]),
+    "04_truncated_mid_string.txt": ({"titulo", "resumen", "dias"}, [4, 4, 2]),
+    "05_truncated_after_key.txt": ({"titulo", "resumen", "dias"}, [4, 4, 4]),
+    "06_unescaped_quotes.txt": ({"titulo", "resumen", "dias"}, [4, 4, 4]),
+    "07_missing_commas.txt": ({"titulo", "resumen", "dias"}, [4, 4, 4]),
+    "08_literal_newlines.txt": ({"titulo", "resumen", "dias"}, [4, 4, 4]),
+    "09_compact_valid.txt": ({"titulo", "resumen", "dias"}, [4, 4, 4]),
+    "10_chat_text.txt": (None, None),
+    "11_category_aliases.txt": ({"titulo", "resumen", "dias"}, [4, 4, 4]),
+    "12_patch.txt": ({"patch"}, None),
+}
+
+
+def test_corpus_is_covered():
+    assert {path.name for path in CORPUS_DIR.glob("*.txt")} == set(EXPECTED)
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED))
+def test_corpus_file(name):
+    keys, items_per_day = EXPECTED[name]
+    text = (CORPUS_DIR / name).read_text(encoding="utf-8")
+
+    obj = extract_json_object(text)
+    assert (None if obj is None else set(obj)) == keys
+
+    itinerary = parse_itinerary(text)
+    if items_per_day is None:
+        assert itinerary is None
+    else:
+        assert [len(day["itinerario"]) for day in itinerary["dias"]] == items_per_day
+        assert [day["dia"] for day in itinerary["dias"]] == list(range(1, len(items_per_day) + 1))
+
+
+def test_category_aliases_are_normalised():
+    text = (CORPUS_DIR / "11_category_aliases.txt").read_text(encoding="utf-8")
+    categories = {
+        item["category"] for day in parse_itinerary(text)["dias"] for item in day["itinerario"]
+    }
+    assert categories <= {"Culture", "Food", "Hiking", "Relaxation", "Sightseeing", "General"}
+
+
+@pytest.mark.parametrize(
+    "broken, expected",
+    [
+        ('{"a": [1, 2,], "b": "x",}', {"a": [1, 2], "b": "x"}),
+        ('{"a": "sin cerrar', {"a": "sin cerrar"}),
+        ('{"a": "x"\n "b": [{"c": 2}\n {"c": 3}]}', {"a": "x", "b": [{"c": 2}, {"c": 3}]}),
+        ('```json\n{"a": 1}\n```\nListo', {"a": 1}),
+        ('{"a": "línea\nsiguiente"}', {"a": "línea\nsiguiente"}),
+    ],
+)
+def test_repair_json(broken, expected):
+    assert json.loads(repair_json(broken)) == expected
@@ -0,0 +1,108 @@
+import pytest
+
+from services.itinerary_patch import PatchError, apply_patch
+
+
+def _itinerary(days=2):
+    return {
+        "titulo": "Madrid",
+        "resumen": "",
+        "dias": [
+            {
+                "dia": n,
+                "titulo_dia": f"Día {n}",
+                "resumen": "",
+                "tip_pro": "",
+                "itinerario": [
+                    {
+                        "hora": "10:00",
+                        "momento": "Mañana",
+                        "activity": f"Museo {n}",
+                        "category": "Culture",
+                        "detalles": "",
+                    }
+                ],
+            }
+            for n in range(1, days + 1)
+        ],
+    }
+
+
+def test_append_with_dash_and_renumber_days():
+    patched = apply_patch(
+        _itinerary(),
+        [
+            {"op": "add", "path": "/dias/0/itinerario/-", "value": {"activity": "Tapas", "category": "food"}},
+            {"op": "add", "path": "/dias/-", "value": {"titulo_dia": "Extra", "itinerario": []}},
+            {"op": "remove", "path": "/dias/0"},
+        ],
+    )
+    assert [day["dia"] for day in patched["dias"]] == [1, 2]
+    assert patched["dias"][1]["titulo_dia"] == "Extra"
+
+
+def test_insert_at_end_index_and_category_normalised():
+    patched = apply_patch(
+        _itinerary(),
+        [{"op": "add", "path": "/dias/0/itinerario/1", "value": {"activity": "Tapas", "category": "food"}}],
+    )
+    assert patched["dias"][0]["itinerario"][1]["category"] == "Food"
+
+
+@pytest.mark.parametrize(
+    "op",
+    [
+        {"op": "remove", "path": "/dias/2"},
+        {"op": "replace", "path": "/dias/0/itinerario/1", "value": {"activity": "X"}},
+        {"op": "add", "path": "/dias/0/itinerario/2", "value": {"activity": "X"}},
+        {"op": "remove", "path": "/dias/-"},
+    ],
+)
+def test_index_out_of_range(op):
+    with pytest.raises(PatchError):
+        apply_patch(_itinerary(), [op])
+
+
+def test_field_aliases():
+    patched = apply_patch(
+        _itinerary(),
+        [
+            {"op": "replace", "path": "/dias/0/itinerario/0/nombre", "value": "Prado"},
+            {"op": "replace", "path": "/dias/0/itinerario/0/categoria", "value": "sightseeing"},
+            {"op": "add", "path": "/dias/1/itinerario/-", "value": {"name": "Retiro", "type": "relaxation", "precio": "0€"}},
+        ],
+    )
+    first = patched["dias"][0]["itinerario"][0]
+    assert (first["activity"], first["category"]) == ("Prado", "Sightseeing")
+    added = patched["dias"][1]["itinerario"][-1]
+    assert (added["activity"], added["category"], added["precio"]) == ("Retiro", "Relaxation", "0€")
+
+
+def test_removing_last_day_is_rejected():
+    with pytest.raises(PatchError):
+        apply_patch(_itinerary(days=1), [{"op": "remove", "path": "/dias/0"}])
+
+
+@pytest.mark.parametrize(
+    "ops",
+    [
+        [],
+        [{"op": "move", "path": "/dias/0"}],
+        [{"op": "replace", "path": "/hotel", "value": "x"}],
+        [{"op": "add", "path": "/dias/0/itinerario/-"}],
+        [{"op": "add", "path": "/dias/0/itinerario/-", "value": {"activity": ""}}],
+        [{"op": "add", "path": "/dias/-", "value": "Día 3"}],
+        [{"op": "add", "path": "/titulo", "value": "x"}],
+        ["remove /dias/0"],
+    ],
+)
+def test_invalid_ops(ops):
+    with pytest.raises(PatchError):
+        apply_patch(_itinerary(), ops)
+
+
+def test_failed_patch_leaves_itinerary_untouched():
+    original = _itinerary()
+    with pytest.raises(PatchError):
+        apply_patch(original, [{"op": "remove", "path": "/dias/0"}, {"op": "remove", "path": "/dias/5"}])
+    assert original == _itinerary()
@@ -0,0 +1,134 @@
+"""
+Informe de recall del índice HNSW de `trip_documents` frente a búsqueda exacta.
+
+Uso (desde backend/):
+    python -m tools.recall_report --k 5 --samples 200
+    python -m tools.recall_report --k 5 --compare-full --limit 300
+
+- Por defecto usa como consultas vectores ya guardados (sin llamar al modelo)
+  y compara los vecinos del índice con los de fuerza bruta sobre esos mismos
+  vectores: mide cuánto pierde HNSW con la configuración actual.
+- Con --compare-full vuelve a calcular los embeddings completos del modelo
+  para los documentos y compara los vecinos exactos en dimensión completa con
+  los del índice reducido (RAG_EMBED_DIM): mide cuánto pierde la reducción.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from services.rag_handler import (
+    COLLECTION_METADATA,
+    COLLECTION_NAME,
+    RAG_EMBED_DIM,
+    live_hnsw_settings,
+    rag_service,
+)
+from services.compact_embeddings import ProjectedEmbeddings
+
+
+def _distances(queries: np.ndarray, vectors: np.ndarray, space: str) -> np.ndarray:
+    if space == "cosine":
+        q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        v = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        return 1.0 - q @ v.T
+    if space == "ip":
+        return -(queries @ vectors.T)
+    # l2 (al cuadrado, el orden es el mismo)
+    return (
+        (queries**2).sum(axis=1)[:, None]
+        - 2 * queries @ vectors.T
+        + (vectors**2).sum(axis=1)[None, :]
+    )
+
+
+def _exact_neighbors(
+    queries: np.ndarray, vectors: np.ndarray, query_rows: list, k: int, space: str
+) -> list:
+    dist = _distances(queries, vectors, space)
+    # La propia consulta no cuenta como vecino
+    dist[np.arange(len(query_rows)), query_rows] = np.inf
+    return [list(np.argsort(row)[:k]) for row in dist]
+
+
+def _load_collection(limit: int | None):
+    collection = rag_service.vector_store._collection
+    data = collection.get(
+        include=["embeddings", "documents", "metadatas"], limit=limit
+    )
+    return (
+        collection,
+        data["ids"],
+        np.asarray(data["embeddings"], dtype=np.float32),
+        data["documents"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--compare-full", action="store_true")
+    args = parser.parse_args()
+
+    collection, ids, vectors, documents = _load_collection(args.limit)
+    n = len(ids)
+    if n <= args.k:
+        print(f"La colección {COLLECTION_NAME} tiene {n} fragmentos: no hay suficientes.")
+        return
+
+    live = live_hnsw_settings(collection)
+    space = live.get("hnsw:space") or "l2"
+    rng = np.random.default_rng(0)
+    rows = sorted(rng.choice(n, size=min(args.samples, n), replace=False).tolist())
+    id_to_row = {doc_id: i for i, doc_id in enumerate(ids)}
+
+    exact = _exact_neighbors(vectors[rows], vectors, rows, args.k, space)
+
+    started = time.perf_counter()
+    ann_result = collection.query(
+        query_embeddings=vectors[rows].tolist(),
+        n_results=args.k + 1,
+        include=[],
+    )
+    ann_ms = (time.perf_counter() - started) * 1000 / len(rows)
+
+    ann = [
+        [id_to_row[i] for i in found if i in id_to_row and id_to_row[i] != row][
+            : args.k
+        ]
+        for row, found in zip(rows, ann_result["ids"])
+    ]
+    hnsw_recall = np.mean(
+        [len(set(a) & set(e)) / args.k for a, e in zip(ann, exact)]
+    )
+
+    dim = vectors.shape[1]
+    print(f"Colección:            {COLLECTION_NAME} ({n} fragmentos)")
+    print(f"Configuración:        {live or COLLECTION_METADATA}")
+    print(f"Dimensión guardada:   {dim} ({dim * 4} bytes/vector float32)")
+    print(f"Consultas:            {len(rows)}  k={args.k}")
+    print(f"Recall@{args.k} HNSW:       {hnsw_recall:.4f}")
+    print(f"Latencia media ANN:   {ann_ms:.2f} ms/consulta")
+
+    if args.compare_full:
+        if not RAG_EMBED_DIM:
+            print("--compare-full solo tiene sentido con RAG_EMBED_DIM > 0.")
+            return
+        base = rag_service.embeddings
+        if isinstance(base, ProjectedEmbeddings):
+            base = base.base
+        print("Calculando embeddings completos (puede tardar)...")
+        full = np.asarray(base.embed_documents(documents), dtype=np.float32)
+        exact_full = _exact_neighbors(full[rows], full, rows, args.k, space)
+        reduced_recall = np.mean(
+            [len(set(a) & set(e)) / args.k for a, e in zip(ann, exact_full)]
+        )
+        print(f"Dimensión completa:   {full.shape[1]} ({full.shape[1] * 4} bytes/vector)")
+        print(f"Recall@{args.k} reducido vs. exacto completo: {reduced_recall:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Pre-genera los itinerarios de las combinaciones destino/días/estilo más
+pedidas y los guarda en la warm cache (WARM_CACHE_PATH).
+
+Uso (desde backend/):
+    python -m tools.warm_itineraries --budget 200000
+    python -m tools.warm_itineraries --budget 50000 --model fast
+
+Primero se generan las combinaciones con más peticiones registradas y luego
+las de la lista por defecto (WARM_DESTINATIONS x 1-7 días x WARM_STYLES).
+Las que siguen vigentes no se regeneran. Se para al agotar el presupuesto.
+"""
+
+import argparse
+
+from services.warm_cache import WARM_CACHE_MODEL, WARM_CACHE_TOKEN_BUDGET, warm_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget", type=int, default=WARM_CACHE_TOKEN_BUDGET)
+    parser.add_argument("--model", default=WARM_CACHE_MODEL)
+    args = parser.parse_args()
+
+    warm_cache.refresh(token_budget=args.budget, model_name=args.model)
+    print(warm_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
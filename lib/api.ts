@@ -135,3 +135,131 @@ export async function uploadFile(
     throw error
   }
 }
+
+/**
+ * Sube varios archivos en una sola petición. El backend los analiza en
+ * paralelo y responde en NDJSON: `onResult` se llama con cada archivo en
+ * cuanto termina y la promesa resuelve con el resumen final ("done").
+ */
+export async function uploadFiles(
+  files: File[],
+  sessionId: string,
+  model?: string,
+  onResult?: (result: any) => void,
+): Promise<any> {
+  const formData = new FormData()
+  for (const file of files) {
+    formData.append("files", file)
+  }
+  formData.append("session_id", sessionId)
+  if (model) {
+    formData.append("model", model)
+  }
+
+  try {
+    const response = await fetch("http://localhost:8000/api/files/upload/batch", {
+      method: "POST",
+      body: formData,
+    })
+
+    if (!response.ok || !response.body) {
+      const errorText = await response.text()
+      throw new Error(`Error subiendo archivos: ${errorText}`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ""
+    let summary: any = null
+
+    const handleLine = (line: string) => {
+      if (!line.trim()) return
+      const event = JSON.parse(line)
+      if (event.event === "file") {
+        onResult?.(event)
+      } else {
+        summary = event
+      }
+    }
+
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      const lines = buffer.split("\n")
+      buffer = lines.pop() ?? ""
+      lines.forEach(handleLine)
+    }
+    handleLine(buffer)
+
+    return summary
+  } catch (error) {
+    console.error("Error en uploadFiles:", error)
+    throw error
+  }
+}
+
+export interface ChatSocketHandlers {
+  /** Trozo de texto de la respuesta en curso */
+  onToken?: (text: string, turn: number) => void
+  /** Respuesta final: mismo formato que generateItinerary */
+  onResult?: (result: any, turn: number) => void
+  /** El patch no era válido: descartar los tokens recibidos del turno */
+  onRestart?: (turn: number) => void
+  onCancelled?: (turn: number) => void
+  /** Eventos de análisis de archivos subidos en la sesión */
+  onUpload?: (event: any) => void
+  onError?: (error: string, turn?: number) => void
+}
+
+/**
+ * Abre un chat por WebSocket. La conexión mantiene modelo y sesión entre
+ * turnos; enviar un mensaje nuevo cancela la respuesta anterior en curso.
+ */
+export function openChatSocket(
+  sessionId: string,
+  handlers: ChatSocketHandlers,
+  model?: string,
+) {
+  const params = new URLSearchParams({ session_id: sessionId })
+  if (model) params.set("model", model)
+  const socket = new WebSocket(`ws://localhost:8000/api/chat/ws?${params}`)
+
+  socket.onmessage = (message) => {
+    const { type, turn, ...event } = JSON.parse(message.data)
+    switch (type) {
+      case "token":
+        handlers.onToken?.(event.text, turn)
+        break
+      case "result":
+        handlers.onResult?.(event, turn)
+        break
+      case "restart":
+        handlers.onRestart?.(turn)
+        break
+      case "cancelled":
+        handlers.onCancelled?.(turn)
+        break
+      case "upload":
+        handlers.onUpload?.(event)
+        break
+      case "error":
+        handlers.onError?.(event.error, turn)
+        break
+    }
+  }
+
+  return {
+    socket,
+    send(data: TripRequest) {
+      const { session_id: _ignored, ...rest } = data
+      socket.send(JSON.stringify({ type: "message", ...rest }))
+    },
+    cancel() {
+      socket.send(JSON.stringify({ type: "cancel" }))
+    },
+    close() {
+      socket.close()
+    },
+  }
+}